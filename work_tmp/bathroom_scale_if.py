@@ -1,8 +1,12 @@
-import socket
+import asyncio
 import threading
+import time
+import statistics
+import configparser
 import sqlite3 as sql
 import pathlib
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import datetime
 
 import logging
 
@@ -11,18 +15,172 @@ bathlogger.setLevel(logging.DEBUG)
 
 mod_path = pathlib.Path(__file__).parent
 
+# Received measurements are written to the DB in a batch this long after the first one arrives.
+write_delay_s = 1.0
+
+# User for all measurements if no users are set up in piscale.ini, and for measurements that aren't near any user's.
+default_user = "Richard"
+unknown_user = "Unknown"
+
+
+# Weight from a scale message, which is b'<something>,<weight>'. Returns None if the message isn't a measurement.
+def parse_measurement(data):
+    parts = data.split(b',')
+
+    try:
+        weight = float(parts[1])
+    except (IndexError, ValueError):
+        return None
+
+    if not 0 < weight < 500:
+        return None
+
+    return weight
+
+
+# Throws out the repeats the scale sends of each message, so a measurement is only stored once. A message is a repeat
+# if the same sender sent the same payload within the last window seconds - each repeat restarts the window, so a
+# long burst is all dropped however late the last of it arrives. Different measurements are never dropped, even if
+# they come close together (e.g. two people weighing one after the other).
+#
+# Messages are remembered in an OrderedDict, oldest first, so expired ones are removed from the front and each
+# message costs O(1). No more than max_entries are remembered.
+class BroadcastDeduplicator:
+    def __init__(self, window=30.0, max_entries=1024):
+        self.window = window
+        self.max_entries = max_entries
+        self.last_seen = OrderedDict()
+
+        self.accepted = 0
+        self.dropped = 0
+
+    # True if the message is new, False if it's a repeat.
+    def accept(self, sender, data, now=None):
+        now = time.monotonic() if now is None else now
+        key = (sender, hash(bytes(data)))
+
+        # Forget messages not seen for the window.
+        while self.last_seen and next(iter(self.last_seen.values())) < now - self.window:
+            self.last_seen.popitem(last=False)
+
+        repeat = key in self.last_seen
+
+        self.last_seen[key] = now
+        self.last_seen.move_to_end(key)
+
+        if len(self.last_seen) > self.max_entries:
+            self.last_seen.popitem(last=False)
+
+        if repeat:
+            self.dropped = self.dropped + 1
+        else:
+            self.accepted = self.accepted + 1
+
+        return not repeat
+
+
+# Works out whose measurement it is from the weight, for a scale shared by a household. Each user's recent weight is
+# the median of their last few measurements, or the seed weight they were set up with until they have some. A
+# measurement belongs to the user whose recent weight is nearest if it is within the tolerance. Further away than
+# that, it still goes to the nearest user if no one else is close - nearer them than anyone else by more than the
+# tolerance - so a real change in weight, or a weigh-in after a long gap, carries their recent weight along. Only a
+# measurement that could be either of two users is put down to unknown_user, to be sorted out by hand.
+#
+# assign() is called on the scale's event loop and load() from the GUI, so the recent weights are locked.
+class UserAssigner:
+    def __init__(self, seed_weights, tolerance_kg=4.0, recent_measurements=5):
+        self.seed_weights = seed_weights
+        self.tolerance_kg = tolerance_kg
+        self.recent_measurements = recent_measurements
+
+        # User to their recent weights, oldest first.
+        self.recent_weights = {}
+        self.lock = threading.Lock()
+
+    # Sets each user's recent weights, e.g. from the history, replacing what was there.
+    def load(self, recent_weights):
+        with self.lock:
+            self.recent_weights = {user: list(weights[-self.recent_measurements:])
+                                   for user, weights in recent_weights.items()}
+
+    # Called with the lock held.
+    def recent_weight(self, user):
+        weights = self.recent_weights.get(user)
+
+        if weights:
+            return statistics.median(weights)
+
+        return self.seed_weights[user]
+
+    def assign(self, weight):
+        if not self.seed_weights:
+            return default_user
+
+        with self.lock:
+            distances = sorted((abs(weight - self.recent_weight(name)), name) for name in self.seed_weights)
+            distance, user = distances[0]
+
+            if distance > self.tolerance_kg and len(distances) > 1 and \
+                    distances[1][0] - distance <= self.tolerance_kg:
+                return unknown_user
+
+            weights = self.recent_weights.setdefault(user, [])
+            weights.append(weight)
+            del weights[:-self.recent_measurements]
+
+        return user
+
+
+# Passes datagrams received on one of the scale's ports on to the BathroomScaleIF.
+class BathroomScaleProtocol(asyncio.DatagramProtocol):
+    def __init__(self, scale_if, local_addr):
+        self.scale_if = scale_if
+        self.local_addr = local_addr
+
+    def datagram_received(self, data, addr):
+        self.scale_if.message_received(data, addr, self.local_addr)
+
+    def error_received(self, exc):
+        bathlogger.warning(f"Error on {self.local_addr}: {exc}")
+
 
 # Class to manage the interface ot the Bathroom scale. Receives UDP messages, throwing out duplicates and adds them
 # to a database which can then be queried.
+#
+# The thread runs an asyncio event loop, with a datagram endpoint for each (ip, port) to listen on - so more than one
+# scale or port can be received from. Other network I/O can be run on the same loop with run_coroutine().
 class BathroomScaleIF(threading.Thread):
-    def __init__(self, udp_ip_port):
+    def __init__(self, udp_ip_ports):
         threading.Thread.__init__(self)
 
         bathlogger.debug(f"Startup {__name__}")
 
-        self.sock = socket.socket(socket.AF_INET,  # Internet
-                                  socket.SOCK_DGRAM)  # UDP
-        self.sock.bind(udp_ip_port)
+        self.udp_ip_ports = udp_ip_ports
+        self.loop = asyncio.new_event_loop()
+        self.transports = []
+
+        # Throws out the repeats the scale sends.
+        self.deduplicator = BroadcastDeduplicator()
+
+        # Users sharing the scale, from the body_weight_users section of piscale.ini - name = starting weight in kg.
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config.read('piscale.ini')
+
+        seed_weights = {}
+
+        if config.has_section('body_weight_users'):
+            seed_weights = {user: float(weight) for user, weight in config['body_weight_users'].items()}
+
+        body_weight_config = config['body_weight'] if config.has_section('body_weight') else {}
+
+        self.user_assigner = UserAssigner(seed_weights,
+                                          float(body_weight_config.get('user_tolerance_kg', 4.0)),
+                                          int(body_weight_config.get('user_recent_measurements', 5)))
+
+        # Measurements waiting to be written, and the timer that will write them.
+        self.pending_measurements = []
+        self.write_timer = None
 
         # Connect to the DB.
         self.body_weight_db = sql.connect(f'{mod_path}/body_weight_history.db', check_same_thread=False)
@@ -50,59 +208,123 @@ class BathroomScaleIF(threading.Thread):
                         );
                     """)
 
-    # Thread's run function receives data and processes the received body weights by adding them to the DB.
+            # Queries are by date, most recent first, so the date is indexed - and by user then date for a user's
+            # measurements. Added to tables created before the indexes.
+            self.body_weight_db.execute("CREATE INDEX IF NOT EXISTS BodyWeightHistoryDate ON BodyWeightHistory(Date)")
+            self.body_weight_db.execute("CREATE INDEX IF NOT EXISTS BodyWeightHistoryUserDate "
+                                        "ON BodyWeightHistory(User, Date)")
+
+        self.load_recent_weights()
+
+    # Thread's run function - listens for the scale's messages on all the ports, processing them as they come in.
     def run(self):
-        last_msg_received_time = None
-        print("run")
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.listen())
+        self.loop.run_forever()
 
-        # Receive UDP messages from the scale, throw away duplicates.
-        while True:
-            data, addr = self.sock.recvfrom(1024)  # buffer size is 1024 bytes
+    async def listen(self):
+        for udp_ip_port in self.udp_ip_ports:
+            transport, protocol = await self.loop.create_datagram_endpoint(
+                lambda local_addr=udp_ip_port: BathroomScaleProtocol(self, local_addr),
+                local_addr=udp_ip_port, allow_broadcast=True)
 
-            # Get time of the message, strip out surrounding junk and compare to other
-            # messages to throw out duplicates.
-            now = datetime.now()
-            result = str(data).split(',')
-            weight = float(result[1][:-1].strip())
+            self.transports.append(transport)
+            bathlogger.info(f"Listening for the bathroom scale on {udp_ip_port}")
 
-            if last_msg_received_time is None:
-                last_msg_received_time = now
-                print(f"received message:{now}, {data}, {result}, {weight}")
-                with self.body_weight_db:
+    # Run a coroutine on the thread's event loop, from any thread. Returns a concurrent.futures.Future.
+    def run_coroutine(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
 
-                    # Add to body weight history
-                    self.body_weight_db.execute("INSERT INTO BodyWeightHistory (Date, User, Weight) values(?, ?, ?)"
-                                                , [now, "Richard", weight])
+    # Processes a message from the scale. Runs on the event loop.
+    def message_received(self, data, addr, local_addr):
+        now = datetime.now()
+        weight = parse_measurement(data)
 
-            # Ensure the message is actually a new measurement - Scale sends multiple messages to ensure the measurement
-            # is received.
-            else:
-                time_diff = now - last_msg_received_time
+        if weight is None:
+            bathlogger.warning(f"Ignoring message from {addr} on {local_addr}: {data[:64]!r}")
+            return
 
-                if time_diff > timedelta(minutes=1):
-                    print("new measurement")
-                    last_msg_received_time = now
-                    bathlogger.debug(f"received message:{now}, {data}, {result}, {weight}")
+        # Ensure the message is actually a new measurement - Scale sends multiple messages to ensure the measurement
+        # is received.
+        if not self.deduplicator.accept(addr[0], data):
+            return
 
-                    with self.body_weight_db:
-                        # Add to body weight history
-                        self.body_weight_db.execute("INSERT INTO BodyWeightHistory (Date, User, Weight) values(?, ?, ?)"
-                                                    , [now, "Richard", weight])
+        user = self.user_assigner.assign(weight)
 
-    # Provide database records to the caller. num_records of 0 will return all records.
-    def return_records(self, num_records=0):
-        body_weight_history = self.body_weight_db.execute("SELECT id, Date, User,Weight FROM BodyWeightHistory")
+        bathlogger.debug(f"received message:{now}, {addr}, {data}, {weight} for {user}")
 
-        ret_list = []
+        self.pending_measurements.append((str(now), user, weight))
+
+        if self.write_timer is None:
+            self.write_timer = self.loop.call_later(write_delay_s, self.write_measurements)
+
+    # Add the measurements received to body weight history, all in one transaction.
+    def write_measurements(self):
+        measurements = self.pending_measurements
+        self.pending_measurements = []
+        self.write_timer = None
+
+        with self.body_weight_db:
+            self.body_weight_db.executemany("INSERT INTO BodyWeightHistory (Date, User, Weight) values(?, ?, ?)",
+                                            measurements)
 
-        for item in body_weight_history:
-            # print(item)
-            ret_list.append(item)
+        bathlogger.info(f"Added {len(measurements)} body weight measurements, {self.deduplicator.accepted} messages "
+                        f"accepted and {self.deduplicator.dropped} repeats dropped so far")
+
+    # Provide database records to the caller, oldest first. num_records of 0 will return all records, otherwise the
+    # most recent num_records - only those are read, using the date index. Optionally just the given user's records.
+    def return_records(self, num_records=0, user=None):
+        query = "SELECT id, Date, User, Weight FROM BodyWeightHistory"
+        params = []
+
+        if user is not None:
+            query = query + " WHERE User = ?"
+            params.append(user)
 
         if num_records == 0:
-            return ret_list
-        else:
-            return ret_list[:-num_records]
+            return self.body_weight_db.execute(query + " ORDER BY Date", params).fetchall()
+
+        # Most recent first to use the LIMIT, then put back in date order.
+        records = self.body_weight_db.execute(query + " ORDER BY Date DESC LIMIT ?", params + [num_records]).fetchall()
+        records.reverse()
+
+        return records
+
+    # Records from start_date up to but not including end_date, oldest first. Dates are datetimes or strings in the
+    # same format as stored, e.g. '2024-07-07' or '2024-07-07 07:51:16'. Either can be None for no limit.
+    def records_between(self, start_date=None, end_date=None, user=None):
+        conditions = []
+        params = []
+
+        if start_date is not None:
+            conditions.append("Date >= ?")
+            params.append(str(start_date))
+
+        if end_date is not None:
+            conditions.append("Date < ?")
+            params.append(str(end_date))
+
+        if user is not None:
+            conditions.append("User = ?")
+            params.append(user)
+
+        query = "SELECT id, Date, User, Weight FROM BodyWeightHistory"
+
+        if conditions:
+            query = query + " WHERE " + " AND ".join(conditions)
+
+        return self.body_weight_db.execute(query + " ORDER BY Date", params).fetchall()
+
+    # Users with measurements in the history.
+    def users(self):
+        return [row[0] for row in self.body_weight_db.execute("SELECT DISTINCT User FROM BodyWeightHistory")]
+
+    # Loads each user's most recent measurements into the user assigner, so a deleted bad measurement no longer
+    # counts towards their recent weight.
+    def load_recent_weights(self):
+        self.user_assigner.load({user: [record[3] for record in
+                                        self.return_records(self.user_assigner.recent_measurements, user)]
+                                 for user in self.user_assigner.seed_weights})
 
     # Deletes the record entry in the database according to ID
     def delete_entry(self, db_id):
@@ -110,9 +332,11 @@ class BathroomScaleIF(threading.Thread):
         print(f"Deleted {db_id}")
         self.body_weight_db.commit()
 
+        self.load_recent_weights()
+
 
 if __name__ == '__main__':
-    bath_if = BathroomScaleIF(("255.255.255.255", 6000))
+    bath_if = BathroomScaleIF([("255.255.255.255", 6000)])
 
     bath_if.start()
 
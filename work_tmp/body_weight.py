@@ -4,12 +4,16 @@ from tkinter import messagebox
 
 from datetime import datetime
 import pathlib
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import bathroom_scale_if
+import db_watermark
+import history
 
 # importing the required module
 import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 import logging
 import configparser
@@ -22,18 +26,64 @@ mod_path = pathlib.Path(__file__).parent
 # Need to use this if no interactive window.
 matplotlib.use('Agg')
 
-bathroom_scale_if_ip_port = ("255.255.255.255", 6000)
+# Addresses the bathroom scale's broadcasts are received on - more can be added for other ports or scales.
+bathroom_scale_if_ip_ports = [("255.255.255.255", 6000)]
 
+# User choice for showing everyone's measurements.
+all_users = "All"
 
-# Plots the Body Weight history bar chart along with a line showing start weight and target
+
+# Plots the Body Weight history bar chart along with a line showing start weight and target. The figure is created
+# once and kept - each new plot just updates the line data and axis limits, and nothing is rendered at all if the data
+# hasn't changed.
 class WeightHistoryPlotter:
     def __init__(self, max_plot_points):
-        matplotlib.pyplot.rcParams["savefig.format"] = 'jpg'
         self.max_plot_points = max_plot_points
         self.label_increment = 1
 
-    # Saves the plot to a file. Makes it available for use by the application or for sending out.
-    def plot_save(self, body_weight_history, start_weight, target_weight, file_name):
+        # The long lived figure and the artists that get updated. Created on the first plot.
+        self.fig = None
+        self.ax = None
+        self.start_line = None
+        self.target_line = None
+        self.weight_line = None
+
+        # Data of the last plot, to tell if anything has changed.
+        self.last_plot_data = None
+
+    # Sets up the figure with everything that doesn't change between plots.
+    def create_figure(self, x_data, y_data):
+        plt.style.use('dark_background')
+
+        # Set up the plot. Not using pyplot's figure management, so the figure stays until it is replaced.
+        self.fig = Figure(figsize=(6.25, 4))
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+
+        # Plot starting and target weights
+        self.start_line = self.ax.axhline(y=0, linewidth=1, color='r', zorder=5)
+        self.target_line = self.ax.axhline(y=0, linewidth=1, color='g', zorder=5)
+
+        self.weight_line, = self.ax.plot(x_data, y_data, '-', color = '#1E90FF', zorder = 10)
+
+        # rotate and align the tick labels so they look bette
+        self.fig.autofmt_xdate()
+
+        # naming the x axis
+        self.ax.set_xlabel('Date')
+
+        # naming the y axis
+        self.ax.set_ylabel('Body Weight')
+
+        # Turn on the grid.
+        self.ax.grid(True, linestyle=':', zorder=5)
+
+        # giving a title to my graph
+        self.ax.set_title('Body Weight')
+
+    # Plots the body weight history and returns it as an image, ready to show. Also saved to file_name if given, which
+    # makes it available for sending out. Returns None if the data was the same as last time, so nothing needed doing.
+    def plot_save(self, body_weight_history, start_weight, target_weight, file_name=None, user=None):
         # print("plotting")
         x_data = []
         y_data = []
@@ -47,76 +97,88 @@ class WeightHistoryPlotter:
         x_data = x_data[-self.max_plot_points:]
         y_data = y_data[-self.max_plot_points:]
 
-        # Set up the plot
-        fig, ax = plt.subplots(figsize=(6.25, 4))
+        plot_data = (x_data, y_data, start_weight, target_weight, user)
 
-        # Plot starting and target weights
-        plt.axhline(y=start_weight, linewidth=1, color='r', zorder=5)
-        plt.axhline(y=target_weight, linewidth=1, color='g', zorder=5)
+        if plot_data == self.last_plot_data:
+            blogger.debug("Body weight history unchanged, not re-plotting")
+            return None
 
-        ax.plot(x_data, y_data, '-', color = '#1E90FF', zorder = 10)
+        if self.fig is None:
+            self.create_figure(x_data, y_data)
 
-        # rotate and align the tick labels so they look bette
-        fig.autofmt_xdate()
+        self.start_line.set_ydata([start_weight, start_weight])
+        self.target_line.set_ydata([target_weight, target_weight])
+        self.weight_line.set_data(x_data, y_data)
+        self.ax.set_title('Body Weight' if user is None else f'Body Weight - {user}')
 
-        # naming the x axis
-        matplotlib.pyplot.xlabel('Date')
+        # Rescale to the new data.
+        self.ax.relim()
+        self.ax.autoscale_view()
 
-        # naming the y axis
-        matplotlib.pyplot.ylabel('Body Weight')
+        # rotate and align the tick labels so they look bette
+        self.fig.autofmt_xdate()
 
-        # Turn on the grid.
-        matplotlib.pyplot.grid(True, linestyle=':', zorder=5)
+        image = history.figure_image(self.fig)
 
-        # giving a title to my graph
-        matplotlib.pyplot.title('Body Weight')
+        if file_name:
+            image.convert('RGB').save(file_name)
 
-        matplotlib.pyplot.savefig(file_name)
+        self.last_plot_data = plot_data
 
-        # Close the plot to reduce memory usage.
-        matplotlib.pyplot.close()
+        return image
 
 
-# Class to manage the updating of the history graph.
+# Class to manage the updating of the history graph. The graph is shown as soon as it is plotted.
 class HistoryGrapher(tk.Frame):
     def __init__(self, frame):
         tk.Frame.__init__(self, frame)
-        img = ImageTk.PhotoImage(Image.open('weight_history_graph.jpg'))
-        self.graph_label = tk.Label(frame, image=img)
-        self.graph_label.image = img
+        self.graph_label = tk.Label(frame)
+        self.graph_label.image = None
         self.graph_label.grid(column=0, row=0)
-        # self.update_graph()
 
-    # Update the graph as it changes over time.
-    def update_graph(self):
-        img = ImageTk.PhotoImage(Image.open('weight_history_graph.jpg'))
+    # Show a newly plotted graph image.
+    def show_image(self, image):
+        img = ImageTk.PhotoImage(image)
         self.graph_label.configure(image=img)
         self.graph_label.image = img
-        self.after(60 * 1000 * 13, self.update_graph)  # Update after 13 minutes
 
 
 # Class to create the Weight History
 class WeightHistoryFrame(tk.Frame):
-    def __init__(self, frame, num_of_measurement_points):
+    def __init__(self, frame, num_of_measurement_points, history_grapher, chart_renderer, graph_file=None):
         tk.Frame.__init__(self, frame)
 
         self.history_tree = None
         self.frame = frame
         self.num_of_measurement_points = num_of_measurement_points
 
+        # Where the graph is shown, the worker that renders it, and optionally a file to also save it to.
+        self.history_grapher = history_grapher
+        self.chart_renderer = chart_renderer
+        self.graph_file = graph_file
+
         # Create the Food Data Tree
         history_tree_frame = tk.Frame(self.frame)
         self.create_weight_history_tree(history_tree_frame)
         history_tree_frame.grid(column=0, row=0)
-        self.last_weight_history = None
+        self.weight_plotter = WeightHistoryPlotter(self.num_of_measurement_points)
 
         delete_btn = ttk.Button(self.master, text="Del", command=self.del_entry, style='piscale.TButton', width=5)
         delete_btn.grid(column=0, row=1)
 
-        self.bathroom_scale_if = bathroom_scale_if.BathroomScaleIF(bathroom_scale_if_ip_port)
+        self.bathroom_scale_if = bathroom_scale_if.BathroomScaleIF(bathroom_scale_if_ip_ports)
         self.bathroom_scale_if.daemon = True
         self.bathroom_scale_if.start()
 
+        # Choose whose measurements are shown, or everyone's.
+        self.user_selection = tk.StringVar(value=all_users)
+        self.user_combo = ttk.Combobox(self.master, textvariable=self.user_selection, state='readonly', width=12)
+        self.user_combo.bind('<<ComboboxSelected>>', lambda event: self.show_history())
+        self.user_combo.grid(column=0, row=2)
+
+        # The history is only re-read when measurements have been added or deleted.
+        self.weight_watermark = db_watermark.TableWatermark(self.bathroom_scale_if.body_weight_db, 'BodyWeightHistory')
+
     # Deletes the entry requested - usually to clean up a poor measurement for some reason.
     def del_entry(self):
         # print("delete")
@@ -153,7 +215,7 @@ class WeightHistoryFrame(tk.Frame):
         self.history_tree = ttk.Treeview(history_tree_frame, columns=('db_id', 'Date', 'User', 'Weight'),
                                          show='headings', height=17)
 
-        self.history_tree["displaycolumns"] = ('Date', 'Weight')
+        self.history_tree["displaycolumns"] = ('Date', 'User', 'Weight')
 
         self.history_tree.column('Date', anchor=tk.W, width=110)
         self.history_tree.column('User', anchor=tk.E, width=50)
@@ -172,17 +234,32 @@ class WeightHistoryFrame(tk.Frame):
 
     # Populate the history Tree View. search_date is used to get the information for that date.
     def populate_history(self):
-        self.history_tree.delete(*self.history_tree.get_children())
+        # Only re-read when measurements have been added or deleted. New users are added to the choices.
+        if self.weight_watermark.changed():
+            self.user_combo['values'] = [all_users] + sorted(set(self.bathroom_scale_if.user_assigner.seed_weights) |
+                                                             set(self.bathroom_scale_if.users()))
+            self.show_history()
 
-        weight_history = self.bathroom_scale_if.return_records()
+        # self.todays_calories_value_label.configure(text = (f"{self.todays_calories:.0f} kCal"))
+        self.after(60 * 1000 * 7,
+                   self.populate_history)  # Update every 7 minutes - to ensure the day change gets included
+
+    # Shows the selected user's measurements in the tree and graph.
+    def show_history(self):
+        user = self.user_selection.get()
+        user = None if user == all_users else user
+
+        # Only the measurements that are shown and plotted are read.
+        weight_history = self.bathroom_scale_if.return_records(self.num_of_measurement_points, user)
 
         # print(weight_history)
 
-        # Plot the last 6 months
-        if self.last_weight_history is None or self.last_weight_history != weight_history:
-            weight_plotter = WeightHistoryPlotter(self.num_of_measurement_points)
-            weight_plotter.plot_save(weight_history, 94, 75, 'weight_history_graph.jpg')
-            #weight_plotter.plot_weight(weight_history, 94, 75)
+        # Rendered off the GUI thread, the graph is shown when it's done.
+        self.chart_renderer.submit('weight_history', self.weight_plotter.plot_save,
+                                   (weight_history, 94, 75, self.graph_file, user), self.history_grapher.show_image)
+        #weight_plotter.plot_weight(weight_history, 94, 75)
+
+        self.history_tree.delete(*self.history_tree.get_children())
 
         self.history_tree.tag_configure('odd', font=("fixedsys", 8), background='gray30')
         self.history_tree.tag_configure('even', font=("fixedsys", 8))
@@ -202,17 +279,11 @@ class WeightHistoryFrame(tk.Frame):
                                          tags='odd')
             index = index + 1
 
-        self.last_weight_history = weight_history
-
-        # self.todays_calories_value_label.configure(text = (f"{self.todays_calories:.0f} kCal"))
-        self.after(60 * 1000 * 7,
-                   self.populate_history)  # Update every 7 minutes - to ensure the day change gets included
-
 
 # Class to manaage the history frame of the Application.
 class BodyWeightFrame:
 
-    def __init__(self, frame):
+    def __init__(self, frame, chart_renderer):
         self.master_frame = frame
 
         config = configparser.ConfigParser()
@@ -222,14 +293,16 @@ class BodyWeightFrame:
         self.weight_history_frame = ttk.Frame(self.master_frame)
         self.graph_frame = ttk.Frame(self.master_frame)
 
+        # The graph is updated by the Weight History whenever it re-plots.
+        history_grapher = HistoryGrapher(self.graph_frame)
+
         # Object for the Weight History.
         self.weight_history = WeightHistoryFrame(self.weight_history_frame,
-                                                 int(config['body_weight']['measurement_points']))
+                                                 int(config['body_weight']['measurement_points']),
+                                                 history_grapher, chart_renderer,
+                                                 config['body_weight'].get('graph_file'))
         self.weight_history.populate_history()
 
-        history_grapher = HistoryGrapher(self.graph_frame)
-        history_grapher.update_graph()
-
         self.weight_history_frame.grid(column=0, row=0)
         self.graph_frame.grid(column=1, row=0)
 
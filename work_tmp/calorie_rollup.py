@@ -0,0 +1,93 @@
+import sqlite3 as sq
+import pathlib
+
+import logging
+
+hlogger = logging.getLogger('historyLogger')
+
+mod_path = pathlib.Path(__file__).parent
+
+
+# Per day totals of calories in (meals in History) and calories out (Google Fit points in CaloriesSpent), kept in the
+# DailyCalories table of calories_in_out.db. The totals are updated for just the days that change as meals are added
+# and Google Fit data is written, so the history view reads a row per day rather than every raw record.
+#
+# Every change to a day bumps its Version, so readers can tell what has changed since they last looked.
+#
+# Each thread should have its own CalorieRollup - sqlite connections aren't shared between threads here.
+class CalorieRollup:
+    def __init__(self):
+        self.db_con = sq.connect(f'{mod_path}/calories_in_out.db')
+
+        # The raw records live in their own databases.
+        self.db_con.execute("ATTACH DATABASE ? AS history", (f'{mod_path}/history.db',))
+        self.db_con.execute("ATTACH DATABASE ? AS spent", (f'{mod_path}/calories_spent.db',))
+
+        with self.db_con:
+            list_of_tables = self.db_con.execute(
+                """SELECT name FROM sqlite_master WHERE type='table'
+                AND name='DailyCalories'; """).fetchall()
+
+            # Indexes so a day's raw records can be found without scanning the tables.
+            self.db_con.execute("CREATE INDEX IF NOT EXISTS history.HistoryDate ON History(Date)")
+            self.db_con.execute("CREATE INDEX IF NOT EXISTS spent.CaloriesSpentStart ON CaloriesSpent(StartDateTime)")
+
+            if not list_of_tables:
+                hlogger.info("Table not found, creating DailyCalories")
+
+                # Day is the local date, YYYY-MM-DD.
+                self.db_con.execute(""" CREATE TABLE IF NOT EXISTS DailyCalories(
+                        Day TEXT NOT NULL PRIMARY KEY,
+                        CaloriesIn INTEGER NOT NULL DEFAULT 0,
+                        CaloriesOut FLOAT NOT NULL DEFAULT 0,
+                        Version INTEGER NOT NULL DEFAULT 0
+                        );
+                    """)
+
+        # Fill the rollup from all the existing records - only needed the once.
+        if not list_of_tables:
+            self.refresh_calories_in()
+            self.refresh_calories_out()
+
+    # Recalculates calories in for each day from from_day (YYYY-MM-DD) onwards, or for all days if None.
+    def refresh_calories_in(self, from_day=None):
+        self.refresh_days('CaloriesIn', 'SUM(WEIGHT)', 'substr(Date, 1, 10)', 'history.History', 'Date', from_day)
+
+    # Recalculates calories out for each day from from_day (YYYY-MM-DD) onwards, or for all days if None.
+    def refresh_calories_out(self, from_day=None):
+        self.refresh_days('CaloriesOut', 'SUM(Calories)', 'substr(StartDateTime, 1, 10)', 'spent.CaloriesSpent',
+                          'StartDateTime', from_day)
+
+    # Works out the per day totals of the raw records and updates the days whose total has changed.
+    def refresh_days(self, column, total, day, table, date_column, from_day):
+        from_day = '' if from_day is None else from_day
+        next_version = "(SELECT IFNULL(MAX(Version), 0) + 1 FROM DailyCalories)"
+
+        with self.db_con:
+            # Days that no longer have any records.
+            self.db_con.execute(
+                f"UPDATE DailyCalories SET {column} = 0, Version = {next_version} "
+                f"WHERE Day >= ? AND {column} != 0 "
+                f"AND Day NOT IN (SELECT {day} FROM {table} WHERE {date_column} >= ?)", (from_day, from_day))
+
+            cursor = self.db_con.execute(
+                f"INSERT INTO DailyCalories (Day, {column}, Version) "
+                f"SELECT {day}, {total}, {next_version} FROM {table} WHERE {date_column} >= ? GROUP BY {day} "
+                f"ON CONFLICT(Day) DO UPDATE SET {column} = excluded.{column}, Version = excluded.Version "
+                f"WHERE {column} != excluded.{column}", (from_day,))
+
+        hlogger.debug(f"Rollup of {column} from {from_day} updated {cursor.rowcount} days")
+
+    # Version of the latest change to the rollup - changes whenever any day does.
+    def version(self):
+        return self.db_con.execute("SELECT IFNULL(MAX(Version), 0) FROM DailyCalories").fetchone()[0]
+
+    # Earliest day changed after the given version (None for all changes), or None if nothing has changed.
+    def first_changed_day(self, version=None):
+        return self.db_con.execute("SELECT MIN(Day) FROM DailyCalories WHERE Version > ?",
+                                   (0 if version is None else version,)).fetchone()[0]
+
+    # Rows of Day, CaloriesIn, CaloriesOut for every day, oldest first.
+    def days(self):
+        return self.db_con.execute(
+            "SELECT Day, CaloriesIn, CaloriesOut FROM DailyCalories ORDER BY Day").fetchall()
@@ -0,0 +1,67 @@
+import threading
+import queue
+
+import logging
+
+hlogger = logging.getLogger('historyLogger')
+
+
+# Renders charts on its own thread so the GUI keeps responding (weight readings, touch) while matplotlib works.
+#
+# Jobs are submitted with a key, one per chart. If a chart is asked for again before its last job has started, the
+# older job is dropped - only the latest data for each chart is ever rendered. Finished images are put on a queue
+# that the Tk loop polls, and the job's callback is run from there, so callbacks can safely update widgets.
+#
+# The plotters keep their figures between renders, so a plotter should only be used through the one worker.
+class ChartRenderWorker(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self)
+
+        # Jobs waiting to be rendered, by key. Protected by the condition, which is notified when a job is added.
+        self.pending_jobs = {}
+        self.jobs_available = threading.Condition()
+
+        # Rendered results to be handed to the Tk loop.
+        self.results = queue.Queue()
+
+    # Ask for a chart to be rendered - render_function(*args) is run on the worker thread and, if it returns an image,
+    # callback(image) is run on the Tk thread. Replaces any job with the same key that hasn't started yet.
+    def submit(self, key, render_function, args, callback):
+        with self.jobs_available:
+            if key in self.pending_jobs:
+                hlogger.debug(f"Chart job {key} replaced before it was rendered")
+
+            self.pending_jobs[key] = (render_function, args, callback)
+            self.jobs_available.notify()
+
+    # Thread's run function - renders jobs as they come in, oldest chart first.
+    def run(self):
+        while True:
+            with self.jobs_available:
+                while not self.pending_jobs:
+                    self.jobs_available.wait()
+
+                key = next(iter(self.pending_jobs))
+                render_function, args, callback = self.pending_jobs.pop(key)
+
+            try:
+                image = render_function(*args)
+            except Exception:
+                hlogger.exception(f"Chart job {key} failed")
+                continue
+
+            if image is not None:
+                self.results.put((key, image, callback))
+
+    # Hand any finished images to their callbacks. Runs on the Tk thread, via widget's after() every interval_ms.
+    def poll_results(self, widget, interval_ms=100):
+        while True:
+            try:
+                key, image, callback = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            hlogger.debug(f"Chart {key} rendered")
+            callback(image)
+
+        widget.after(interval_ms, self.poll_results, widget, interval_ms)
@@ -5,8 +5,13 @@ import time
 from datetime import datetime
 import sqlite3 as sq
 import pathlib
+import configparser
 from PIL import Image, ImageTk
 import config
+import food_data_db
+import calorie_rollup
+import db_watermark
+import virtual_tree
 
 import logging
 
@@ -16,6 +21,15 @@ dlogger.setLevel(logging.INFO)
 mod_path = pathlib.Path(__file__).parent
 favorite_radio_sel = None
 
+# Nutrients recorded in the meal history, in MealHistory column order.
+meal_nutrients = ('PROT', 'FAT', 'CHO', 'CHOL', 'TOTSUG', 'AOACFIB')
+
+# How long typing has to pause before a type-ahead search runs.
+search_debounce_ms = 150
+
+# How often the weight is checked while food is waiting for it to settle.
+settle_poll_ms = 100
+
 
 # FoodDataFrame Contains all the food data from the database and the search mechanism.
 class FoodDataFrame(ttk.Frame):
@@ -31,6 +45,17 @@ class FoodDataFrame(ttk.Frame):
 
         self.food_data_db_con = sq.connect(f'{mod_path}/food_data.db')
 
+        # Nutrients are stored as numbers - converts databases imported before that was the case.
+        food_data_db.normalise_food_data(self.food_data_db_con)
+
+        # Full text index used for searching - falls back to LIKE searches if not available.
+        self.search_index = food_data_db.create_search_index(self.food_data_db_con)
+        self.search_cache = food_data_db.FoodSearchCache(self.food_data_db_con, use_index=self.search_index)
+
+        # Pending type-ahead search and the rows currently shown, so unchanged results aren't redrawn.
+        self.search_after_id = None
+        self.displayed_food_data = None
+
         # Create the Food Data Tree
         self.food_data_tree_frame = ttk.Frame(self.main_food_frame)
         self.create_food_data_tree(self.food_data_tree_frame)
@@ -50,6 +75,9 @@ class FoodDataFrame(ttk.Frame):
             font=config.widget_font
         )
 
+        # Search as the user types (including from the onscreen keyboard).
+        self.search_str.trace_add('write', self.search_changed)
+
         # Calculates and displays the calorie content of the selected itme given the weight.
         self.selected_item_cal_label = ttk.Label(self.main_food_frame, text="")  # , font=("Helvetica", 11))
 
@@ -70,10 +98,11 @@ class FoodDataFrame(ttk.Frame):
         food_data_tree_frame.columnconfigure(0, weight=4)
         food_data_tree_frame.columnconfigure(1, weight=1)
 
-        # List of food and their characteristics.
-        self.food_tree_view = ttk.Treeview(food_data_tree_frame,
-                                           columns=('db_id', 'FoodCode', 'FoodName', 'kCal', 'Fave'),
-                                           show='headings', height=16)
+        # List of food and their characteristics. Only the rows in view are in the tree - the rest are paged in from
+        # the row store as the list is scrolled.
+        self.food_tree_view = virtual_tree.VirtualTreeview(food_data_tree_frame, row_format=self.food_row,
+                                                           columns=('db_id', 'FoodCode', 'FoodName', 'kCal', 'Fave'),
+                                                           show='headings', height=16)
 
         self.food_tree_view["displaycolumns"] = ('FoodName', 'kCal')
         self.food_tree_view.column('FoodName', anchor=tk.W, width=380)
@@ -85,17 +114,38 @@ class FoodDataFrame(ttk.Frame):
         self.food_tree_view.heading('Fave', text="Fave")
         self.food_tree_view.grid(column=0, row=0)
 
+        self.food_tree_view.tag_configure('odd', font=config.data_font, background='gray4')
+        self.food_tree_view.tag_configure('even', font=config.data_font, background='gray12')
+        self.food_tree_view.tag_configure('odd_fave', font=config.data_font, foreground='IndianRed1',
+                                          background='gray4')
+        self.food_tree_view.tag_configure('even_fave', font=config.data_font, foreground='IndianRed1',
+                                          background='gray12')
+
         sb = ttk.Scrollbar(food_data_tree_frame, orient=tk.VERTICAL, style="wide_scroll.Vertical.TScrollbar")
         sb.grid(column=1, row=0, sticky='nsew')
 
-        self.food_tree_view.config(yscrollcommand=sb.set)
-        sb.config(command=self.food_tree_view.yview)
+        self.food_tree_view.set_scrollbar(sb)
 
     # Search the database based on the entry.
-    def search_food_data(self, event):
+    def search_food_data(self, event=None):
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+            self.search_after_id = None
+
         search_str = self.search_str.get()
-        print(search_str, event)
-        self.populate_food_data(search=search_str)
+        dlogger.debug(f"Search {search_str} {event}")
+
+        if food_data_db.normalise_search(search_str):
+            self.populate_food_data(search=search_str)
+        else:
+            self.populate_food_data()
+
+    # Search entry has changed - debounce the keystrokes so the search runs once typing pauses.
+    def search_changed(self, *args):
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+
+        self.search_after_id = self.after(search_debounce_ms, self.search_food_data)
 
     # Bring onscreen keyboard up.
     def keyb(self):
@@ -106,7 +156,6 @@ class FoodDataFrame(ttk.Frame):
 
     # Grab the data from the Database and add it to the TreeView table.
     def populate_food_data(self, search=None):
-        self.food_tree_view.delete(*self.food_tree_view.get_children())
 
         # print(f"Search String {search}")
 
@@ -116,65 +165,48 @@ class FoodDataFrame(ttk.Frame):
                 if search is None:
                     # print("search is None")
                     food_data = self.food_data_db_con.execute(
-                        "SELECT id, FoodCode, FoodName, KCALS, Favourite FROM FoodData")
+                        "SELECT id, FoodCode, FoodName, KCALS, Favourite FROM FoodData").fetchall()
                 else:
-                    search = f"%{search}%"
-                    # print(f"Search String 2 {search}")
-                    food_data = self.food_data_db_con.execute(
-                        "SELECT id, FoodCode, FoodName, KCALS, Favourite FROM FoodData WHERE FoodName LIKE ?",
-                        (search,))
+                    # Ranked search via the full text index, cached so type-ahead is cheap.
+                    food_data = self.search_cache.search(search)
             else:
                 food_data = self.food_data_db_con.execute(
                     "SELECT id, FoodCode, FoodName, KCALS, Favourite FROM FoodData"
-                    " WHERE Favourite=1")
+                    " WHERE Favourite=1").fetchall()
 
-        self.food_tree_view.tag_configure('odd', font=config.data_font, background='gray4')
-        self.food_tree_view.tag_configure('even', font=config.data_font, background='gray12')
-        self.food_tree_view.tag_configure('odd_fave', font=config.data_font, foreground='IndianRed1',
-                                          background='gray4')
-        self.food_tree_view.tag_configure('even_fave', font=config.data_font, foreground='IndianRed1',
-                                          background='gray12')
+        # Nothing to do if the results haven't changed, e.g. a keystroke that didn't change the matches.
+        if food_data == self.displayed_food_data:
+            return
+
+        # The food view tree only takes the rows that are in view - see food_row for the formatting.
+        self.displayed_food_data = food_data
+        self.food_tree_view.set_rows(food_data)
+
+    # Formats a row of food data for the food view tree. This is where user selects food.
+    @staticmethod
+    def food_row(food, index):
 
         # TODO: Can't get images to work with the tree view.
         # small_fave_image = ImageTk.PhotoImage(Image.open(f'{mod_path}/images/fave.png').resize((32, 32)))
 
-        index = 0
+        if food[3] is None:  # Not measured or a trace.
+            k_cal = 0
+        else:
+            k_cal = int(food[3])
 
-        # Adding food to the food view tree. This is where user selects food.
-        for food in food_data:
-            if food[3] == 'N' or food[3] == 'Tr' or food[3] == '':
-                k_cal = '0'
-            else:
-                k_cal = int(food[3])
+        if food[4] == 1:  # Check to see if a favourite - if it is a favourite, the formatting is different.
+            tags = 'even_fave' if index % 2 else 'odd_fave'
+        else:
+            tags = 'even' if index % 2 else 'odd'
 
-            if food[4] == 1:  # Check to see if a favourite - if it is a favourite, the formatting is different.
-                if index % 2:
-                    self.food_tree_view.insert(parent='', index=food[0],
-                                               values=(food[0], food[1], food[2], k_cal, food[4]),
-                                               tags='even_fave')
-                else:
-                    self.food_tree_view.insert(parent='', index=food[0],
-                                               values=(food[0], food[1], food[2], k_cal, food[4]),
-                                               tags='odd_fave')
-            else:
-                if index % 2:
-                    self.food_tree_view.insert(parent='', index=food[0],
-                                               values=(food[0], food[1], food[2], k_cal, food[4]),
-                                               tags='even')
-                else:
-                    self.food_tree_view.insert(parent='', index=food[0],
-                                               values=(food[0], food[1], food[2], k_cal, food[4]),
-                                               tags='odd')
-            index = index + 1
+        return (food[0], food[1], food[2], k_cal, food[4]), tags
 
     # update the string of the selected item
     def update_item_calories(self):
-        selected = self.food_tree_view.selection()
+        chosenfood = self.food_tree_view.selected_values()
         # print(selected)
-        if len(selected) != 0:
-            chosenfood = self.food_tree_view.item(selected[0])
-            # print(chosenfood)
-            db_id, food_code, food_name, kcalories_per_100, fave = chosenfood["values"]
+        if chosenfood is not None:
+            db_id, food_code, food_name, kcalories_per_100, fave = chosenfood
             # print(self.weight)
             food_calories = float(kcalories_per_100) * self.weight.get_weight() / 100
             if food_calories < 0:
@@ -197,6 +229,16 @@ class MealFrame(ttk.Frame):
         self.food_data_db_con = sq.connect(f'{mod_path}/food_data.db')
         self.meal_history_db_con = sq.connect(f'{mod_path}/meal_history.db')
 
+        # Daily calorie totals, updated as meals are added to the history.
+        self.calorie_rollup = calorie_rollup.CalorieRollup()
+
+        # Today's history is only re-read when a meal has been added, or on a new day.
+        self.history_watermark = db_watermark.TableWatermark(self.history_db_con, 'History')
+        self.history_day = None
+
+        # Nutrient content of all the foods, for working out what is in a meal.
+        self.nutrients = food_data_db.NutrientMatrix(self.food_data_db_con, meal_nutrients)
+
         # Create the Food Data Tree
         self.meal_tree_view = None
         self.todays_calories = None
@@ -339,10 +381,17 @@ class MealFrame(ttk.Frame):
 
     # Populate the history Tree View. search_date is used to get the information for that date.
     def populate_history(self):
-        self.calorie_history_view.delete(*self.calorie_history_view.get_children())
-
         today = str(datetime.now())[:10]
 
+        # Nothing to do if the history hasn't changed since it was shown, and it's still the same day.
+        if not self.history_watermark.changed() and today == self.history_day:
+            self.after(60 * 60 * 1000, self.populate_history)
+            return
+
+        self.history_day = today
+
+        self.calorie_history_view.delete(*self.calorie_history_view.get_children())
+
         search_date = f"%{today}%"
         # print(search_date)
 
@@ -394,70 +443,30 @@ class MealFrame(ttk.Frame):
         now = datetime.now().replace(microsecond=0)
         now.replace(second=0)
 
-        # Get all the items from the meal.
-        meal = self.meal_tree_view.get_children()
-        for part in meal:
-            # print(part)
-            # print(self.meal_tree_view.item(part)['values'])
-            fooddata_db_id, foodcode, foodname, weight, calories = self.meal_tree_view.item(part)['values']
-            print(fooddata_db_id, foodcode, foodname, weight, calories)
-
-            if fooddata_db_id != 0:
-                dlogger.debug(f"Food data being gathered for {fooddata_db_id} {fooddata_db_id}, {foodcode}, {foodname}, "
-                             f"{weight}, {calories})")
-                part_data = self.food_data_db_con.execute(
-                    "SELECT id, FoodCode, FoodName, PROT, FAT, CHO, CHOL, TOTSUG, AOACFIB FROM FoodData WHERE id = ?",
-                    (fooddata_db_id,))
-
-                for data in part_data:
-
-                    data_id, foodcode, foodname, protein, fat, cho, chol, totsug, aoacfib = data
-                    # print(id, foodcode, foodname, protein, fat, cho, chol, totsug, aoacfib)
-
-                    weight = float(weight)
-                    if protein != 'N' and protein != 'Tr' and protein != '':
-                        tot_protein = protein * weight / 100
-                    else:
-                        tot_protein = 0
-
-                    if fat != 'N' and fat != 'Tr' and fat != '':
-                        tot_fat = fat * weight / 100
-                    else:
-                        tot_fat = 0
-
-                    if cho != 'N' and cho != 'Tr' and cho != '':
-                        tot_cho = cho * weight / 100
-                    else:
-                        tot_cho = 0
-
-                    if chol != 'N' and chol != 'Tr' and chol != '':
-                        tot_chol = chol * weight / 100
-                    else:
-                        tot_chol = 0
-
-                    if totsug != 'N' and totsug != 'Tr' and totsug != '':
-                        tot_sug = totsug * weight / 100
-                    else:
-                        tot_sug = 0
-
-                    if aoacfib != 'N' and aoacfib != 'Tr' and aoacfib != '':
-                        tot_aoacfib = aoacfib * weight / 100
-                    else:
-                        tot_aoacfib = 0
-
-                    dlogger.info(f'Meal History Add -->weight {weight}g protein {tot_protein}g, fat {tot_fat}g, '
-                                f'carbs {tot_cho}g, chol {tot_chol}g, sugar {tot_sug}g, aoacfib {tot_aoacfib}')
-
-                    # TODO: Add Saturated FAT to the meal history.
-                    ret = self.meal_history_db_con.execute(
-                        'INSERT INTO MealHistory (unix_ms, Date, fooddata_db_id, FoodName,'
-                        'PROT, FAT, CHO, CHOL, TOTSUG, AOACFIB, KCALS, WEIGHT) '
-                        ' values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                        [now_micro, now, fooddata_db_id, foodname,
-                         tot_protein, tot_fat, tot_cho, tot_chol,
-                         tot_sug, tot_aoacfib, calories, weight])
-                    dlogger.info(f'sql return {ret}')
-                    self.meal_history_db_con.commit()
+        # Get all the items from the meal. Adhoc items (id of 0) aren't in the food data so only go into History.
+        meal = [self.meal_tree_view.item(part)['values'] for part in self.meal_tree_view.get_children()]
+        foods = [part for part in meal if part[0] != 0]
+
+        if foods:
+            # Nutrients for all the foods in one go - rows of grams of each of meal_nutrients.
+            totals = self.nutrients.totals([part[0] for part in foods], [float(part[3]) for part in foods])
+
+            meal_history = []
+            for (fooddata_db_id, foodcode, foodname, weight, calories), nutrients in zip(foods, totals.tolist()):
+                tot_protein, tot_fat, tot_cho, tot_chol, tot_sug, tot_aoacfib = nutrients
+
+                dlogger.info(f'Meal History Add -->{fooddata_db_id} {foodname} weight {weight}g protein '
+                             f'{tot_protein}g, fat {tot_fat}g, carbs {tot_cho}g, chol {tot_chol}g, sugar {tot_sug}g, '
+                             f'aoacfib {tot_aoacfib}')
+
+                meal_history.append([now_micro, now, fooddata_db_id, foodname, *nutrients, calories, float(weight)])
+
+            # TODO: Add Saturated FAT to the meal history.
+            with self.meal_history_db_con:
+                self.meal_history_db_con.executemany(
+                    'INSERT INTO MealHistory (unix_ms, Date, fooddata_db_id, FoodName,'
+                    'PROT, FAT, CHO, CHOL, TOTSUG, AOACFIB, KCALS, WEIGHT) '
+                    ' values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', meal_history)
 
         if self.meal_total_calories != 0:
             with self.history_db_con:
@@ -465,6 +474,8 @@ class MealFrame(ttk.Frame):
                                             [now, 0, int(self.meal_total_calories)])
                 self.history_db_con.commit()
 
+            self.calorie_rollup.refresh_calories_in(str(now)[:10])
+
         # Update the history tree
         self.populate_history()
 
@@ -482,6 +493,17 @@ class DailyFrame:
 
         self.weight = weight
 
+        # Food waiting for the weight to settle before it is added to the meal, and how long it will wait.
+        self.food_waiting_to_settle = None
+        self.settle_timeout_id = None
+        self.settle_poll_id = None
+
+        ini = configparser.ConfigParser()
+        ini.read('piscale.ini')
+        self.settle_timeout_ms = ini['scale_stability'].getint('settle_timeout_ms', 3000)
+
+        self.weight.add_listener(self.weight_changed)
+
         global favorite_radio_sel
 
         favorite_radio_sel= tk.IntVar()
@@ -601,30 +623,77 @@ class DailyFrame:
         self.inter_frame.grid(column=1, row=0, pady=30, sticky='n')
         meal_frame.grid(column=2, row=0, sticky='n')
 
-    # Add an item to the meal calculating total meal calories.
+    # Add an item to the meal calculating total meal calories. Uses the settled weight - if the scale is still
+    # settling, the food is added when it settles, or with the weight at the time if it takes too long.
     def add_to_meal(self):
-        selected = self.food_data_frame.food_tree_view.selection()
-        print(selected)
-        if selected != ():
-            chosenfood = self.food_data_frame.food_tree_view.item(selected[0])
-            # print(chosenfood)
-            db_id, food_code, food_name, kcalories_per_100, fave = chosenfood["values"]
-            # print(self.weight)
-            food_weight = self.weight.get_weight()
-            # print(food_name, calories_per_100)
-            food_calories = float(kcalories_per_100) * food_weight / 100
-            if food_calories < 0:
-                food_calories = 0
+        chosenfood = self.food_data_frame.food_tree_view.selected_values()
+        # print(chosenfood)
+        if chosenfood is not None:
+            # The weight display backs off when the weight is steady, so the weight can be seconds out of date - e.g.
+            # still the empty scale's if the food has only just been put on.
+            self.weight.update_weight()
+
+            if self.weight.is_settled():
+                self.add_food_to_meal(chosenfood, self.weight.settled_weight)
+            else:
+                dlogger.debug(f"Waiting for the weight to settle to add {chosenfood[2]}")
 
-            # Add the food item to the end of the meal list.
-            self.meal_frame.meal_tree_view.insert(parent='', index=tk.END, values=(db_id, food_code, food_name, food_weight,
-                                                                                   f"{food_calories:.0f}"))
+                if self.settle_timeout_id is not None:
+                    self.daily_frame.after_cancel(self.settle_timeout_id)
 
-            self.meal_frame.meal_total_calories = self.meal_frame.meal_total_calories + food_calories
-            self.meal_frame.update_meal_calories()
+                self.food_waiting_to_settle = chosenfood
+                self.settle_timeout_id = self.daily_frame.after(self.settle_timeout_ms, self.settle_timed_out)
+
+                if self.settle_poll_id is None:
+                    self.settle_poll_id = self.daily_frame.after(settle_poll_ms, self.poll_weight)
+
+    # Keeps the weight up to date while food is waiting for it to settle, rather than relying on the display's
+    # updates. Settling is seen by weight_changed.
+    def poll_weight(self):
+        self.settle_poll_id = None
+
+        if self.food_waiting_to_settle is not None:
+            self.weight.update_weight()
+
+        if self.food_waiting_to_settle is not None:
+            self.settle_poll_id = self.daily_frame.after(settle_poll_ms, self.poll_weight)
+
+    # Weight listener - adds the food waiting for the weight to settle.
+    def weight_changed(self, event, weight):
+        if event == 'settled' and self.food_waiting_to_settle is not None:
+            self.daily_frame.after_cancel(self.settle_timeout_id)
+            self.add_food_to_meal(self.food_waiting_to_settle, weight)
+
+    # The weight didn't settle in time, so go with what it is now.
+    def settle_timed_out(self):
+        self.weight.update_weight()
+
+        # Updating the weight can have seen it settle, and added the food.
+        if self.food_waiting_to_settle is None:
+            return
+
+        dlogger.info(f"Weight didn't settle, adding {self.food_waiting_to_settle[2]} at {self.weight.get_weight()}g")
+        self.add_food_to_meal(self.food_waiting_to_settle, self.weight.get_weight())
+
+    def add_food_to_meal(self, chosenfood, food_weight):
+        self.food_waiting_to_settle = None
+        self.settle_timeout_id = None
+
+        db_id, food_code, food_name, kcalories_per_100, fave = chosenfood
+        # print(food_name, calories_per_100)
+        food_calories = float(kcalories_per_100) * food_weight / 100
+        if food_calories < 0:
+            food_calories = 0
+
+        # Add the food item to the end of the meal list.
+        self.meal_frame.meal_tree_view.insert(parent='', index=tk.END, values=(db_id, food_code, food_name, food_weight,
+                                                                               f"{food_calories:.0f}"))
+
+        self.meal_frame.meal_total_calories = self.meal_frame.meal_total_calories + food_calories
+        self.meal_frame.update_meal_calories()
 
-            # Zero out the scale, so it is ready for additional food
-            self.weight.zero()
+        # Zero out the scale, so it is ready for additional food
+        self.weight.zero()
 
     # Remove an item from the meal
     def remove_from_meal(self):
@@ -653,14 +722,13 @@ class DailyFrame:
 
     # Marks or un-marks a food as a favourite.
     def toggle_favourite(self):
-        selected = self.food_data_frame.food_tree_view.selection()
+        chosenfood = self.food_data_frame.food_tree_view.selected_values()
 
         # TODO: sort out multiple selections.
-        for sel_item in selected:
-            # print(sel_item)
-            data_id = self.food_data_frame.food_tree_view.item(selected[0])["values"][0]
+        if chosenfood is not None:
+            data_id = chosenfood[0]
 
-            if self.food_data_frame.food_tree_view.item(selected[0])["values"][4] == 0:
+            if not chosenfood[4]:
                 favourite = 1
             else:
                 favourite = 0
@@ -669,4 +737,6 @@ class DailyFrame:
             with self.food_data_db_con:
                 self.food_data_db_con.execute("UPDATE FoodData SET Favourite = ? where id= ?", [favourite, data_id])
 
+        # Cached search results hold the old favourite flags.
+        self.food_data_frame.search_cache.clear()
         self.food_data_frame.populate_food_data()
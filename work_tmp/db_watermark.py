@@ -0,0 +1,48 @@
+import logging
+
+hlogger = logging.getLogger('historyLogger')
+
+
+# Tells cheaply whether a table has changed since it was last looked at, so periodic refreshes can skip doing anything
+# when it hasn't.
+#
+# There are two levels of check. The first costs nothing: sqlite's data_version changes when another connection
+# commits to the database, and the connection's total_changes when it makes changes itself. If neither has moved,
+# the table can't have changed. Otherwise the watermark expression is worked out, by default the table's max rowid
+# and row count - enough for tables that are only added to and deleted from. Tables that are updated in place need
+# their own expression, e.g. a version column.
+#
+# table can include the schema of an attached database, e.g. 'history.History'.
+class TableWatermark:
+    def __init__(self, db_con, table, expression=None):
+        self.db_con = db_con
+        self.table = table
+        self.expression = expression if expression is not None else f"SELECT MAX(rowid), COUNT(*) FROM {table}"
+
+        schema = table.split('.')[0] + '.' if '.' in table else ''
+        self.data_version_pragma = f"PRAGMA {schema}data_version"
+
+        self.last_gate = None
+        self.value = None
+
+    # True if the table has changed since the last call, always True the first time. The watermark is then up to
+    # date, in value.
+    def changed(self):
+        gate = (self.db_con.execute(self.data_version_pragma).fetchone()[0], self.db_con.total_changes)
+
+        if gate == self.last_gate:
+            return False
+
+        self.last_gate = gate
+        value = self.db_con.execute(self.expression).fetchone()
+
+        if len(value) == 1:
+            value = value[0]
+
+        if value == self.value and self.value is not None:
+            hlogger.debug(f"{self.table} changes didn't move the watermark {value}")
+            return False
+
+        self.value = value
+
+        return True
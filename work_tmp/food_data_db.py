@@ -0,0 +1,398 @@
+import re
+import csv
+import time
+import itertools
+import sqlite3 as sq
+import unicodedata
+from collections import OrderedDict
+import numpy
+
+import db_watermark
+
+import logging
+
+dlogger = logging.getLogger("dailyLogger")
+
+# Nutrient columns of FoodData, in table order. All hold grams (or kCal/kJ) per 100g of the food.
+nutrient_columns = ('WATER', 'TOTNIT', 'PROT', 'FAT', 'CHO', 'KCALS', 'KJ', 'STAR', 'OLIGO', 'TOTSUG', 'GLUC',
+                    'GALACT', 'FRUCT', 'SUCR', 'MALT', 'LACT', 'ALCO', 'ENGFIB', 'AOACFIB', 'SATFAC', 'SATFOD',
+                    'TOTn6PFAC', 'TOTn6PFOD', 'TOTn3PFAC', 'TOTn3PFOD', 'MONOFACc', 'MONOFODc', 'MONOFAC', 'MONOFOD',
+                    'POLYFACc', 'POLYFODc', 'POLYFAC', 'POLYFOD', 'SATFACx6', 'SATFODx6', 'TOTBRFAC', 'TOTBRFOD',
+                    'FACTRANS', 'FODTRANS', 'CHOL')
+
+# Markers the McCance & Widdowson dataset uses instead of numbers. 'N' is a nutrient that is present but not
+# measured, 'Tr' is a trace. Both are stored as NULL with the marker kept in the NutrientFlags column, e.g.
+# "KCALS=N,CHOL=Tr". Empty values are just NULL.
+nutrient_flags = ('N', 'Tr')
+
+# Descriptive columns of FoodData, in the order they appear in the dataset CSV (before the nutrients).
+text_columns = ('FoodCode', 'FoodName', 'Description', 'FoodGroup', 'Previous', 'Main_data_references', 'Footnote')
+
+# Columns that identify a food when a new release of the dataset is imported. The FoodCode alone would do, except
+# the 2021 dataset reuses 13-669 for two different foods.
+food_key_columns = ('FoodCode', 'FoodName')
+
+# Number of heading rows at the top of the dataset CSV.
+csv_heading_rows = 3
+
+# Full text index over the searchable FoodData columns. It is an external content table, so the text is only stored
+# once (in FoodData) and the triggers below keep the index in step with inserts, updates and deletes.
+search_table = 'FoodDataSearch'
+
+# Relative weighting of the indexed columns when ranking results - a hit on the food name matters much more than
+# one on the description or food group.
+search_rank_weights = (10.0, 1.0, 2.0)
+
+
+# Makes sure the full text index exists for the food database, creating and filling it if needed. Returns True if the
+# index can be used, False if this sqlite build doesn't have FTS5 (search then falls back to LIKE).
+def create_search_index(db_con):
+    with db_con:
+        list_of_tables = db_con.execute(
+            """SELECT name FROM sqlite_master WHERE type='table'
+            AND name=?; """, (search_table,)).fetchall()
+
+        if list_of_tables:
+            return True
+
+        dlogger.info(f"Table not found, creating {search_table}")
+
+        try:
+            db_con.execute(f""" CREATE VIRTUAL TABLE {search_table} USING fts5(
+                    FoodName,
+                    Description,
+                    FoodGroup,
+                    content='FoodData',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='2 3'
+                    );
+                """)
+        except sq.OperationalError as err:
+            dlogger.warning(f"Full text search not available, using LIKE searches {err=}")
+            return False
+
+        # Triggers keep the index in sync with FoodData. Updates only re-index when a searchable column changes, so
+        # toggling a favourite doesn't touch the index.
+        db_con.execute(f""" CREATE TRIGGER FoodDataSearchInsert AFTER INSERT ON FoodData BEGIN
+                INSERT INTO {search_table}(rowid, FoodName, Description, FoodGroup)
+                values(new.id, new.FoodName, new.Description, new.FoodGroup);
+                END;
+            """)
+        db_con.execute(f""" CREATE TRIGGER FoodDataSearchDelete AFTER DELETE ON FoodData BEGIN
+                INSERT INTO {search_table}({search_table}, rowid, FoodName, Description, FoodGroup)
+                values('delete', old.id, old.FoodName, old.Description, old.FoodGroup);
+                END;
+            """)
+        db_con.execute(f""" CREATE TRIGGER FoodDataSearchUpdate AFTER UPDATE OF FoodName, Description, FoodGroup
+                ON FoodData BEGIN
+                INSERT INTO {search_table}({search_table}, rowid, FoodName, Description, FoodGroup)
+                values('delete', old.id, old.FoodName, old.Description, old.FoodGroup);
+                INSERT INTO {search_table}(rowid, FoodName, Description, FoodGroup)
+                values(new.id, new.FoodName, new.Description, new.FoodGroup);
+                END;
+            """)
+
+        # Index everything that is already in FoodData.
+        db_con.execute(f"INSERT INTO {search_table}({search_table}) values('rebuild')")
+
+    return True
+
+
+# Creates the FoodData table if it doesn't exist, along with the unique index that imports upsert against.
+def create_food_data_table(db_con):
+    nutrient_definitions = ' '.join(f"{column} FLOAT," for column in nutrient_columns)
+
+    with db_con:
+        db_con.execute(f""" CREATE TABLE IF NOT EXISTS FoodData(
+                id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+                FoodCode TEXT,
+                FoodName TEXT,
+                Description TEXT,
+                FoodGroup TEXT,
+                Previous TEXT,
+                Main_data_references TEXT,
+                Footnote TEXT,
+                {nutrient_definitions}
+                Favourite BINARY,
+                NutrientFlags TEXT DEFAULT ''
+                );
+            """)
+
+    # Databases created before the nutrients were numeric need converting before new rows go in.
+    normalise_food_data(db_con)
+
+    with db_con:
+        db_con.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS FoodDataKey ON FoodData({', '.join(food_key_columns)})")
+
+
+# Imports (or re-imports) the McCance & Widdowson dataset CSV. The file is streamed and inserted in batches with
+# executemany, all in one transaction. Foods already in the database are updated in place, so their id and
+# Favourite flag are kept when a new release of the dataset is imported. Returns the number of rows imported.
+def import_food_csv(db_con, csv_file_name, batch_size=1000):
+    create_food_data_table(db_con)
+
+    columns = text_columns + nutrient_columns + ('NutrientFlags',)
+    update_columns = [column for column in columns if column not in food_key_columns]
+
+    sql = (f"INSERT INTO FoodData ({', '.join(columns)}, Favourite) "
+           f"values({', '.join('?' for _ in columns)}, 0) "
+           f"ON CONFLICT({', '.join(food_key_columns)}) DO UPDATE SET "
+           f"{', '.join(f'{column}=excluded.{column}' for column in update_columns)}")
+
+    start = time.perf_counter()
+    count = 0
+
+    with open(csv_file_name, newline='', encoding='utf-16') as food_data_file:
+        food_reader = csv.reader(food_data_file, delimiter=',', quotechar='"')
+
+        # Skip the headings, and any blank lines.
+        rows = (row for row in itertools.islice(food_reader, csv_heading_rows, None) if row)
+
+        with db_con:
+            while True:
+                batch = []
+                for row in itertools.islice(rows, batch_size):
+                    nutrients, flags = normalise_nutrients(row[len(text_columns):])
+                    batch.append(row[:len(text_columns)] + nutrients + [flags])
+
+                if not batch:
+                    break
+
+                db_con.executemany(sql, batch)
+                count = count + len(batch)
+
+    elapsed = time.perf_counter() - start
+    dlogger.info(f"Imported {count} foods from {csv_file_name} in {elapsed:.2f}s "
+                 f"({count / elapsed if elapsed else 0:.0f} rows/s)")
+
+    return count
+
+
+# Converts a nutrient value from the dataset into a number or None, along with its flag (None if there isn't one).
+def normalise_nutrient(value):
+    if isinstance(value, str):
+        value = value.strip()
+
+        if value in nutrient_flags:
+            return None, value
+
+        if value == '':
+            return None, None
+
+    return float(value), None
+
+
+# Normalises the nutrient values of a row being imported - the values are in nutrient_columns order. Returns the
+# numeric values and the NutrientFlags string.
+def normalise_nutrients(values):
+    numbers = []
+    flags = []
+
+    for column, value in zip(nutrient_columns, values):
+        number, flag = normalise_nutrient(value)
+        numbers.append(number)
+        if flag is not None:
+            flags.append(f'{column}={flag}')
+
+    return numbers, ','.join(flags)
+
+
+# Makes sure the nutrient columns only hold numbers or NULL. Older databases were imported with the 'N', 'Tr' and ''
+# strings straight from the dataset - these are converted once, recording the markers in NutrientFlags.
+def normalise_food_data(db_con):
+    with db_con:
+        columns = [column[1] for column in db_con.execute("PRAGMA table_info(FoodData)")]
+
+        if 'NutrientFlags' in columns:
+            return
+
+        dlogger.info("Converting FoodData nutrient columns to numbers")
+        db_con.execute("ALTER TABLE FoodData ADD COLUMN NutrientFlags TEXT DEFAULT ''")
+
+        for column in nutrient_columns:
+            db_con.execute(f"UPDATE FoodData SET NutrientFlags = NutrientFlags || "
+                           f"CASE WHEN NutrientFlags = '' THEN '' ELSE ',' END || '{column}=' || {column} "
+                           f"WHERE {column} IN ({', '.join('?' for _ in nutrient_flags)})", nutrient_flags)
+            db_con.execute(f"UPDATE FoodData SET {column} = NULL WHERE typeof({column}) = 'text'")
+
+
+# Nutrient content of every food held in one contiguous array, indexed by the FoodData id. Loaded up front, so the
+# nutrients for a whole meal come from a single array lookup and multiply rather than a query and checks per food.
+# Unknown and trace values count as 0, as they always have. Reloaded if FoodData has changed since (e.g. re-imported
+# while the app is running), and ids that still aren't in it count as 0 too.
+class NutrientMatrix:
+    def __init__(self, db_con, columns=nutrient_columns):
+        self.db_con = db_con
+        self.columns = tuple(columns)
+        self.column_index = {column: index for index, column in enumerate(self.columns)}
+
+        self.watermark = db_watermark.TableWatermark(db_con, 'FoodData')
+        self.matrix = None
+        self.load()
+
+    def load(self):
+        self.watermark.changed()
+
+        rows = self.db_con.execute(f"SELECT id, {', '.join(self.columns)} FROM FoodData").fetchall()
+        data = numpy.array(rows, dtype=numpy.float64).reshape(-1, len(self.columns) + 1)
+
+        ids = data[:, 0].astype(numpy.int64)
+        self.matrix = numpy.zeros((ids.max() + 1 if len(ids) else 1, len(self.columns)), dtype=numpy.float64)
+        self.matrix[ids] = numpy.nan_to_num(data[:, 1:])
+
+    # Nutrients (in grams) for each food of a meal given the weight of each in grams. Returns an array with a row per
+    # food and a column per requested nutrient.
+    def totals(self, food_ids, weights, columns=None):
+        if columns is None:
+            columns = self.columns
+
+        if self.watermark.changed():
+            dlogger.info("FoodData has changed, reloading the nutrients")
+            self.load()
+
+        food_ids = numpy.asarray(food_ids, dtype=numpy.int64)
+        known = (food_ids >= 0) & (food_ids < len(self.matrix))
+
+        if not known.all():
+            dlogger.warning(f"No nutrients for food ids {food_ids[~known].tolist()}")
+
+        column_indexes = [self.column_index[column] for column in columns]
+        per_gram = self.matrix[numpy.ix_(numpy.where(known, food_ids, 0), column_indexes)] / 100
+        per_gram[~known] = 0
+
+        return per_gram * numpy.asarray(weights, dtype=numpy.float64)[:, None]
+
+
+# Splits the search string into lower case word tokens, the same way the index tokenizer does (including dropping
+# accents, so "creme" finds "Crème").
+def search_tokens(search):
+    decomposed = unicodedata.normalize('NFKD', search.lower())
+    return re.findall(r'\w+', ''.join(c for c in decomposed if not unicodedata.combining(c)))
+
+
+# Normalised form of a search string - used as the cache key. "  Chicken,BREAST" and "chicken breast" are the same.
+def normalise_search(search):
+    return ' '.join(search_tokens(search))
+
+
+# Turns the user's search string into an FTS5 query. Every token has to match and is treated as a prefix, so "chick
+# bre" finds "Chicken, breast".
+def match_query(search):
+    return ' AND '.join(f'"{token}"*' for token in search_tokens(search))
+
+
+# Searches the food data, best matches first. Returns rows of id, FoodCode, FoodName, KCALS, Favourite.
+def search_food(db_con, search, favourites_only=False, use_index=True):
+    return [row[:5] for row in _search_food_text(db_con, search, favourites_only, use_index)]
+
+
+# Does the search, returning the display columns followed by the searchable text columns.
+def _search_food_text(db_con, search, favourites_only, use_index):
+    if not search_tokens(search):
+        return []
+
+    fave_clause = " AND FoodData.Favourite=1" if favourites_only else ""
+
+    if use_index:
+        return db_con.execute(
+            f"SELECT FoodData.id, FoodCode, FoodData.FoodName, KCALS, Favourite,"
+            f" FoodData.Description, FoodData.FoodGroup FROM {search_table}"
+            f" JOIN FoodData ON FoodData.id = {search_table}.rowid"
+            f" WHERE {search_table} MATCH ?{fave_clause}"
+            f" ORDER BY bm25({search_table}, ?, ?, ?)",
+            (match_query(search), *search_rank_weights)).fetchall()
+
+    # No full text index, so fall back to the old LIKE search over each token.
+    tokens = search_tokens(search)
+    where = " AND ".join("FoodName LIKE ?" for _ in tokens)
+    return db_con.execute(
+        f"SELECT id, FoodCode, FoodName, KCALS, Favourite, Description, FoodGroup FROM FoodData"
+        f" WHERE {where}{fave_clause}",
+        [f"%{token}%" for token in tokens]).fetchall()
+
+
+# Caches search results so type-ahead searching is cheap. Results are kept in an LRU keyed by the normalised search.
+# A search that extends an earlier one (e.g. "chi" -> "chick") can only match a subset of the earlier results, so it
+# is answered by filtering those in memory rather than going back to the database.
+#
+# The earlier search's order isn't right for the new one, and bm25 can't be worked out without going back to the
+# index, so filtered results are re-ranked in memory by how well the food name matches - whole words before word
+# prefixes, then shorter names, as bm25 does - keeping the earlier order between equally good names.
+class FoodSearchCache:
+    def __init__(self, db_con, use_index=True, max_entries=64):
+        self.db_con = db_con
+        self.use_index = use_index
+        self.max_entries = max_entries
+
+        # (normalised search, favourites only) -> list of (row, tokens of the searchable text, tokens of the name)
+        self.results = OrderedDict()
+
+    # Drop all cached results - needed when the food data changes, e.g. a favourite is toggled.
+    def clear(self):
+        self.results.clear()
+
+    # Returns rows of id, FoodCode, FoodName, KCALS, Favourite matching the search, best matches first.
+    def search(self, search, favourites_only=False):
+        key = (normalise_search(search), favourites_only)
+
+        if key in self.results:
+            self.results.move_to_end(key)
+            return [result[0] for result in self.results[key]]
+
+        prefix_results = self.prefix_results(key)
+
+        if prefix_results is not None:
+            query_tokens = key[0].split()
+            results = self.rank(query_tokens, [result for result in prefix_results
+                                               if self.matches(query_tokens, result[0], result[1])])
+        else:
+            results = [(row[:5], search_tokens(' '.join(text or '' for text in row[2:3] + row[5:])),
+                        search_tokens(row[2] or ''))
+                       for row in _search_food_text(self.db_con, search, favourites_only, self.use_index)]
+
+        self.results[key] = results
+        if len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+        return [result[0] for result in results]
+
+    # Finds the cached results of the longest earlier search that the new one extends, if there is one.
+    def prefix_results(self, key):
+        search, favourites_only = key
+        best = None
+
+        for cached_search, cached_faves in self.results:
+            if cached_faves == favourites_only and cached_search and search.startswith(cached_search) \
+                    and (best is None or len(cached_search) > len(best)):
+                best = cached_search
+
+        if best is None:
+            return None
+
+        self.results.move_to_end((best, favourites_only))
+        return self.results[(best, favourites_only)]
+
+    # Orders results filtered from an earlier search for the new one. Each search token scores 2 if it is a word of the
+    # food name and 1 if it starts one, ties going to the shorter name. sorted() is stable, so equally good names keep
+    # the earlier search's order.
+    def rank(self, query_tokens, results):
+        if not self.use_index or len(results) < 2:
+            return results
+
+        def name_rank(result):
+            name_tokens = result[2]
+            score = sum(2 if query in name_tokens else
+                        1 if any(token.startswith(query) for token in name_tokens) else 0
+                        for query in query_tokens)
+            return -score, len(name_tokens)
+
+        return sorted(results, key=name_rank)
+
+    # Checks a cached row against the search tokens, using the same rules as the database search.
+    def matches(self, query_tokens, row, tokens):
+        if self.use_index:
+            return all(any(token.startswith(query) for token in tokens) for query in query_tokens)
+
+        food_name = row[2].lower()
+        return all(query in food_name for query in query_tokens)
@@ -17,6 +17,7 @@ import sqlite3 as sql
 import pathlib
 import threading
 import logging.config
+import calorie_rollup
 from socket import gaierror
 
 from oauth2client import client
@@ -103,6 +104,10 @@ class GoogleFitIf(threading.Thread):
 
 
         glogger.info(f"{__name__} Google If run() function start")
+
+        # Daily calorie totals, updated as new calories expended records are written.
+        rollup = calorie_rollup.CalorieRollup()
+
         while(True):
 
             # Get today's date for a later query.
@@ -319,6 +324,10 @@ class GoogleFitIf(threading.Thread):
                         self.start_time = record[1]
                         glogger.info(record)
 
+            # Update the daily totals for the days that have been deleted/re-written - everything after the last
+            # record that was kept.
+            rollup.refresh_calories_out(None if last_record is None else last_record[3][:10])
+
             # Wait to avoid too much interaction with Google
             time.sleep(60*13)
 
@@ -7,10 +7,14 @@ import pathlib
 import numpy
 from PIL import Image, ImageTk
 import configparser
+import calorie_rollup
+import db_watermark
 
 # importing the required module
 import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 import logging.config
 
@@ -24,15 +28,96 @@ mod_path = pathlib.Path(__file__).parent
 matplotlib.use('Agg')
 
 
+# Moving average of daily calories over the last window days that have calories. 0 calorie days are ignored as they
+# may occur if user hasn't entered any values - they carry the previous day's average. Worked out for all days in one
+# pass from the cumulative sum of the non-zero days. Returns whole calories, rounded down.
+def moving_average_skip_zeros(daily_calories, window):
+    daily_calories = numpy.asarray(daily_calories, dtype=numpy.int64)
+    non_zero = daily_calories > 0
+
+    # Running totals of the non-zero days, so any window's total is the difference of two of them.
+    totals = numpy.concatenate(([0], numpy.cumsum(daily_calories[non_zero])))
+    ends = numpy.arange(1, len(totals))
+    starts = numpy.maximum(ends - window, 0)
+    averages = numpy.concatenate(([0], (totals[ends] - totals[starts]) // (ends - starts)))
+
+    # Each day takes the average as of the latest non-zero day up to and including it (0 before there are any).
+    return averages[numpy.cumsum(non_zero)]
+
+
+# Renders the figure and returns it as an RGBA image, straight from the renderer's buffer. The image is a copy, so it
+# isn't changed by the next render.
+def figure_image(fig):
+    fig.canvas.draw()
+    return Image.frombuffer('RGBA', fig.canvas.get_width_height(), fig.canvas.buffer_rgba(), 'raw', 'RGBA', 0,
+                            1).copy()
+
+
 # Plots the Calorie history bar chart along with the 3 lines showing the maintain, slow weight loss, and fast weight
-# loss targets.
+# loss targets. The figure is created once and kept - each new plot just updates the bar heights, line data and labels,
+# and nothing is rendered at all if the data hasn't changed.
 class CalorieHistoryPlotter:
     def __init__(self, max_plot_points):
-        matplotlib.pyplot.rcParams["savefig.format"] = 'jpg'
         self.max_plot_points = max_plot_points
         self.label_increment = 1
 
-    def plot_save(self, calorie_history, file_name):
+        # The long lived figure and the artists that get updated. Created on the first plot.
+        self.fig = None
+        self.ax = None
+        self.bars_in = None
+        self.bars_out = None
+        self.line_in = None
+        self.line_out = None
+        self.bar_labels = []
+
+        # Data of the last plot, to tell if anything has changed.
+        self.last_plot_data = None
+
+    # Sets up the figure with everything that doesn't change between plots.
+    def create_figure(self, num_points):
+        plt.style.use('dark_background')
+
+        # Set up the plot. Not using pyplot's figure management, so the figure stays until it is replaced.
+        self.fig = Figure(figsize=(6.25, 4))
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+
+        # Bar Plot
+        width = 0.40
+
+        x = numpy.arange(num_points)  # the label locations
+        zeros = numpy.zeros(num_points)
+
+        # Turn the grid on.
+        #matplotlib.pyplot.grid(True, axis ='y', linestyle=':', color ='0.8')
+
+        self.bars_in = self.ax.bar(x - width / 2, zeros, width, label='kCal In', color='#000000',
+                                   edgecolor='#23A2DC', zorder =0)
+        self.bars_out = self.ax.bar(x + width / 2, zeros, width, label='kCal Out', color='#000000',
+                                    edgecolor='#DC5D23', zorder =0)
+
+        self.line_in, = self.ax.plot(x, zeros, label='kCal Moving Avg In', linewidth=3, color='#46DC23', zorder =5)
+        self.line_out, = self.ax.plot(x, zeros, label='kCal Moving Avg Out', linewidth=3, color='#B923DC', zorder =5)
+        self.bar_labels = []
+
+        self.ax.legend(loc='lower left')
+        self.ax.set_xticks(x)
+
+        # naming the x axis
+        # self.ax.set_xlabel('Date', fontsize=11)
+
+        # naming the y axis
+        self.ax.set_ylabel('Calories', fontsize=12)
+        self.ax.set_ylim(0, 3000)
+
+        # giving a title to my graph
+        self.ax.set_title('Calorie History', fontsize=14)
+
+        self.ax.tick_params(axis='both', which='major', labelsize=10)
+
+    # Plots the calorie history and returns it as an image, ready to show. Also saved to file_name if given. Returns
+    # None if the data was the same as last time, so nothing needed doing.
+    def plot_save(self, calorie_history, file_name=None):
         # print(data[0])
 
         # Trim to the max history
@@ -44,7 +129,6 @@ class CalorieHistoryPlotter:
         y_moving_average_in = []
         y_moving_average_out = []
 
-
         for i in range(len(calorie_history)):
             x_data.append(calorie_history[i][1])
             y_consumed_data.append(calorie_history[i][2])
@@ -52,60 +136,48 @@ class CalorieHistoryPlotter:
             y_moving_average_in.append(round(calorie_history[i][4]))
             y_moving_average_out.append(round(calorie_history[i][5]))
 
-        # print(x_data, y_consumed_data)
-        plt.style.use('dark_background')
-
-        # Set up the plot
-        fig, ax = plt.subplots(figsize=(6.25, 4))
-
-        # Bar Plot
+        plot_data = (x_data, y_consumed_data, y_expended_data, y_moving_average_in, y_moving_average_out)
 
-        # ax.plot(x_data, y_data)
-        width = 0.40
+        if plot_data == self.last_plot_data:
+            hlogger.debug("Calorie history unchanged, not re-plotting")
+            return None
 
-        x = numpy.arange(len(x_data))  # the label locations
-        # print(x)
+        # A new figure is only needed if the number of days changes (e.g. when there isn't a full history yet).
+        if self.fig is None or len(self.bars_in) != len(x_data):
+            self.create_figure(len(x_data))
 
-        # Turn the grid on.
-        #matplotlib.pyplot.grid(True, axis ='y', linestyle=':', color ='0.8')
+        for bar, height in zip(self.bars_in, y_consumed_data):
+            bar.set_height(height)
 
-        bar_graph1 = ax.bar(x - width / 2, y_consumed_data, width, label='kCal In', color='#000000',
-                            edgecolor='#23A2DC', zorder =0)
-        bar_graph2 = ax.bar(x + width / 2, y_expended_data, width, label='kCal Out', color='#000000',
-                            edgecolor='#DC5D23', zorder =0)
+        for bar, height in zip(self.bars_out, y_expended_data):
+            bar.set_height(height)
 
-        #plt.plot(x, y_consumed_data)
-        #plt.plot(x, y_expended_data)
+        self.line_in.set_ydata(y_moving_average_in)
+        self.line_out.set_ydata(y_moving_average_out)
 
-        plt.plot(x, y_moving_average_in, label='kCal Moving Avg In', linewidth=3, color='#46DC23', zorder =5)
-        plt.plot(x, y_moving_average_out, label='kCal Moving Avg Out', linewidth=3, color='#B923DC', zorder =5)
+        # Bar labels are annotations placed from the bar heights, so replace them. The label text has to be given as
+        # bar_label would otherwise use the values the bars were created with.
+        for label in self.bar_labels:
+            label.remove()
 
-        ax.bar_label(bar_graph1, rotation='vertical', padding=3, color = 'w', zorder =10)
-        ax.bar_label(bar_graph2, rotation='vertical', padding=3, color = 'w', zorder =10)
+        self.bar_labels = self.ax.bar_label(self.bars_in, labels=y_consumed_data, rotation='vertical', padding=3,
+                                            color = 'w', zorder =10) + \
+                          self.ax.bar_label(self.bars_out, labels=y_expended_data,
+                                            rotation='vertical', padding=3, color = 'w', zorder =10)
 
-        ax.legend(loc='lower left')
-        ax.set_xticks(x, x_data)
+        self.ax.set_xticks(numpy.arange(len(x_data)), x_data)
 
         # rotate and align the tick labels so they look better
-        fig.autofmt_xdate()
-        # fig.tight_layout()
-
-        # naming the x axis
-        # matplotlib.pyplot.xlabel('Date', fontsize=11)
-
-        # naming the y axis
-        matplotlib.pyplot.ylabel('Calories', fontsize=12)
-        matplotlib.pyplot.ylim(0, 3000)
+        self.fig.autofmt_xdate()
 
-        # giving a title to my graph
-        matplotlib.pyplot.title('Calorie History', fontsize=14)
+        image = figure_image(self.fig)
 
-        ax.tick_params(axis='both', which='major', labelsize=10)
+        if file_name:
+            image.convert('RGB').save(file_name)
 
-        matplotlib.pyplot.savefig(file_name)
+        self.last_plot_data = plot_data
 
-        # Close the plot to reduce memory usage.
-        matplotlib.pyplot.close()
+        return image
 
     # Sorter for history date - by date.
     @staticmethod
@@ -113,36 +185,37 @@ class CalorieHistoryPlotter:
         return record['date']
 
 
-# Class to manage the updating of the history graph.
+# Class to manage the updating of the history graph. The graph is shown as soon as it is plotted.
 class HistoryGrapher(ttk.Frame):
     def __init__(self, frame):
         ttk.Frame.__init__(self, frame)
-        img = ImageTk.PhotoImage(Image.open('calorie_history_graph.jpg'))
-        self.graph_label = ttk.Label(frame, image=img)
-        self.graph_label.image = img
+        self.graph_label = ttk.Label(frame)
+        self.graph_label.image = None
         self.graph_label.grid(column=0, row=0)
-        # self.update_graph()
 
-    # Update the graph as it changes over time.
-    def update_graph(self):
-        img = ImageTk.PhotoImage(Image.open('calorie_history_graph.jpg'))
+    # Show a newly plotted graph image.
+    def show_image(self, image):
+        img = ImageTk.PhotoImage(image)
         self.graph_label.configure(image=img)
         self.graph_label.image = img
-        self.after(60 * 1000 * 13, self.update_graph)  # Update after 13 minutes
 
 
 # Class to create the Calorie History
 class CalorieHistoryFrame(ttk.Frame):
-    def __init__(self, db_con, frame, moving_averge_days, google_fit_if):
+    def __init__(self, frame, moving_averge_days, history_grapher, chart_renderer, graph_file=None):
         ttk.Frame.__init__(self, frame)
 
         self.history_tree = None
-        self.history_db_con = db_con
         self.frame = frame
         self.moving_average_days = int(moving_averge_days)
 
-        # Set up reference to the Google Fit Interface, which has the data of spent calories.
-        self.google_fit_if = google_fit_if
+        # Where the graph is shown, the worker that renders it, and optionally a file to also save it to.
+        self.history_grapher = history_grapher
+        self.chart_renderer = chart_renderer
+        self.graph_file = graph_file
+
+        # Per day totals of calories in and out, kept up to date as meals and Google Fit data are added.
+        self.calorie_rollup = calorie_rollup.CalorieRollup()
 
         temp_label = ttk.Label(self.frame, text="Temp", style = 'piscale.TButton')
         temp_label.grid(column=0, row=0)
@@ -154,8 +227,12 @@ class CalorieHistoryFrame(ttk.Frame):
         self.last_calorie_history = None
         self.todays_calories = 0
         self.calorie_plotter = CalorieHistoryPlotter(14)
-        self.prev_history_datetime = None
-        self.prev_expended_datetime = None
+        self.prev_rollup_version = None
+
+        # The rollup's version changes whenever a day's calories in or out do. The watermark only works it out when
+        # the rollup has been written to.
+        self.rollup_watermark = db_watermark.TableWatermark(self.calorie_rollup.db_con, 'DailyCalories',
+                                                            "SELECT IFNULL(MAX(Version), 0) FROM DailyCalories")
 
         # Connect to the DB.
         self.calories_in_out_db = sq.connect(f'{mod_path}/calories_in_out.db', check_same_thread=False)
@@ -187,6 +264,13 @@ class CalorieHistoryFrame(ttk.Frame):
                         );
                     """)
 
+            # Days are updated in place, so there is one row per day. Tables that were rebuilt on every refresh
+            # should already be that way, but make sure before adding the index.
+            self.calories_in_out_db.execute(
+                "DELETE FROM CaloriesInOut WHERE id NOT IN (SELECT MAX(id) FROM CaloriesInOut GROUP BY rec_date)")
+            self.calories_in_out_db.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS CaloriesInOutDate ON CaloriesInOut(rec_date)")
+
     # Create the tree view object.
     def create_calorie_history_tree(self, history_tree_frame):
 
@@ -223,78 +307,21 @@ class CalorieHistoryFrame(ttk.Frame):
     # Populate the history Tree View.
     def populate_history(self):
 
-        # Get the last record for the consumed meals.
-        last_history_datetime = self.history_db_con.execute('SELECT * FROM History ORDER BY id DESC LIMIT 1').fetchone()[1]
-        last_calorie_expended_datetime = self.google_fit_if.return_records(num_records=1)[0][3]
-        # print(f"{last_history_datetime} {last_calorie_expended_datetime}")
-
-        # Only update the history information if it has changed. See if it changed by checking he last records
-        # against what was previously processed.
-        hlogger.info(f"Previous data {last_history_datetime} {self.prev_history_datetime}"
-                    f"{last_calorie_expended_datetime} {self.prev_expended_datetime}")
-
-        # Only update the history information if it has changed. See if it changed by checking he last records
-        # against what was previously processed.
-        # print(f"Previous data {last_history_datetime} {self.prev_history_datetime}"
-        #      f"{last_calorie_expended_datetime} {self.prev_expended_datetime}")
-
-        if last_calorie_expended_datetime != self.prev_expended_datetime or \
-                last_history_datetime != self.prev_history_datetime:
+        # Only update the history information if it has changed.
+        if self.rollup_watermark.changed():
+            rollup_version = self.rollup_watermark.value
 
-            hlogger.info(f"Updating history table {last_history_datetime} {self.prev_history_datetime}"
-                        f"{last_calorie_expended_datetime} {self.prev_expended_datetime}")
+            hlogger.info(f"Updating history table {rollup_version} {self.prev_rollup_version}")
 
             self.history_tree.delete(*self.history_tree.get_children())
 
-            # Get the history of calorie consumption from the database.
-            with self.history_db_con:
-                history_data = self.history_db_con.execute("SELECT id, Date, KCALS, Weight FROM History")
-
-            # Group the data per date and calculate total calories per date
-            calorie_history = {}
-
-            for item in history_data:
-                date = datetime.strptime(item[1][:10], "%Y-%m-%d").strftime('%Y-%m-%d')
-
-                day_date = datetime.strptime(item[1][:10], "%Y-%m-%d").strftime('%a %d/%m/%y')
-
-                # print(calorie_history.keys())
-                if day_date in calorie_history.keys():
-                    calorie_history[day_date]['calories consumed'] = calorie_history[day_date]['calories consumed'] \
-                                                                     + item[3]
-                else:
-                    history_rec = {'date': date, 'calories consumed': item[3], 'calories expended': 0}
-                    # print(history_rec)
-                    calorie_history[day_date] = history_rec
-
-            # Get the data for calories expended and add to the dictionary array. If no data of consumed calories, then
-            # set to zero.
-            calories_expended = self.google_fit_if.return_records()
-            for item in calories_expended:
-                # print(item)
-                date = datetime.strptime(item[3][:10], '%Y-%m-%d').strftime('%Y-%m-%d')
-                day_date = datetime.strptime(item[3][:10], '%Y-%m-%d').strftime('%a %d/%m/%y')
-
-                if day_date in calorie_history.keys():
-                    calorie_history[day_date]['calories expended'] = calorie_history[day_date]['calories expended'] \
-                                                                     + item[5]
-                    #hlogger.debug(f"Building Calories Expended {day_date} {item[5]} "
-                    #             f"{calorie_history[day_date]['calories expended']}")
-                else:
-                    history_rec = {'date': date, 'calories consumed': 0, 'calories expended': item[5]}
-                    # print(history_rec)
-                    calorie_history[day_date] = history_rec
-
-            # Sorting is needed as out of order records may have been added.
+            # Per day calories consumed and expended from the rollup, already in date order.
             sorted_data = []
 
             # Build X/Y data
-            for key in calorie_history:
-                record = [calorie_history[key]['date'], key, calorie_history[key]['calories consumed'],
-                          round(calorie_history[key]['calories expended'])]
-                # print(record)
-                sorted_data.append(record)
-            sorted_data.sort()
+            for day, calories_in, calories_out in self.calorie_rollup.days():
+                day_date = datetime.strptime(day, "%Y-%m-%d").strftime('%a %d/%m/%y')
+                sorted_data.append([day, day_date, calories_in, round(calories_out)])
 
             hlogger.debug(f"Sorted Data {sorted_data} processing")
 
@@ -306,92 +333,66 @@ class CalorieHistoryFrame(ttk.Frame):
             self.history_tree.tag_configure('odd', font=("fixedsys", 8), background='gray4')
             self.history_tree.tag_configure('even', font=("fixedsys", 8), background='gray12')
 
-            index = 0
+            # Moving averages for all the days in one go.
+            moving_averages_in = moving_average_skip_zeros([i[2] for i in sorted_data], self.moving_average_days)
+            moving_averages_out = moving_average_skip_zeros([i[3] for i in sorted_data], self.moving_average_days)
 
-            with self.calories_in_out_db:
+            index = 0
 
-                # Delete all the records in the DB - it will be repopulated below.
-                self.calories_in_out_db.execute("DELETE FROM CaloriesInOut;")
-
-                moving_average_kcals_in_list = []
-                moving_average_kcals_in = 0
-
-                moving_average_kcals_out_list = []
-                moving_average_kcals_out = 0
-
-                # Create the table for viewing and also create the temporary database of in/out/moving averages.
-                for i in sorted_data:
-                    insert_data = [0, i[1], 0, i[2], i[3]]
-
-                    # Building up the table.
-                    if index % 2:
-                        self.history_tree.insert(parent='', index=index,
-                                                 values=insert_data,
-                                                 tags='even')
-                    else:
-                        self.history_tree.insert(parent='', index=index,
-                                                 values=insert_data,
-                                                 tags='odd')
-                    index = index + 1
-
-                    # Calculate the moving average by changing the window under consideration and dividing by the
-                    # length of the window. 0 calorie days are ignored as they may occur if user hasn't entered
-                    # any values.
-                    if i[2] > 0:
-                        length = len(moving_average_kcals_in_list)
-                        if length  == self.moving_average_days:
-                            moving_average_kcals_in_list.pop(0)
-                            moving_average_kcals_in_list.append(i[2])
-                        else:
-                            moving_average_kcals_in_list.append(i[2])
-                            length = len(moving_average_kcals_in_list)
-
-                        if length > 0:
-                            moving_average_kcals_in = int(sum(moving_average_kcals_in_list)/length)
-
-                        # print(f"{length} {moving_average_kcals_in} {moving_average_kcals_in_list}")
-
-                    # Calculate the moving average by changing the window under consideration and dividing by the
-                    # length of the window. 0 calorie days are ignored as they may occur if user hasn't entered
-                    # any values.
-                    if i[3] > 0:
-                        length = len(moving_average_kcals_out_list)
-                        if length  == self.moving_average_days:
-                            moving_average_kcals_out_list.pop(0)
-                            moving_average_kcals_out_list.append(i[3])
-                        else:
-                            moving_average_kcals_out_list.append(i[3])
-                            length = len(moving_average_kcals_out_list)
-
-                        if length > 0:
-                            moving_average_kcals_out = int(sum(moving_average_kcals_out_list)/length)
-
-                        # print(f"{length} {moving_average_kcals_out} {moving_average_kcals_out_list}")
-                    i.append(moving_average_kcals_in)
-                    i.append(moving_average_kcals_out)
+            # Create the table for viewing.
+            for i, moving_average_kcals_in, moving_average_kcals_out in zip(sorted_data, moving_averages_in.tolist(),
+                                                                             moving_averages_out.tolist()):
+                insert_data = [0, i[1], 0, i[2], i[3]]
 
+                # Building up the table.
+                if index % 2:
+                    self.history_tree.insert(parent='', index=index,
+                                             values=insert_data,
+                                             tags='even')
+                else:
+                    self.history_tree.insert(parent='', index=index,
+                                             values=insert_data,
+                                             tags='odd')
+                index = index + 1
+
+                i.append(moving_average_kcals_in)
+                i.append(moving_average_kcals_out)
+
+            # Update database, which isn't used in the GUI, but can be accessed for additional analysis or graphing.
+            # Only days from the first one that changed can have new totals or averages, and of those only the rows
+            # that actually differ are written.
+            first_changed_day = self.calorie_rollup.first_changed_day(self.prev_rollup_version)
+            changed_days = []
+
+            for i in sorted_data:
+                if first_changed_day is not None and i[0] >= first_changed_day:
                     # Translate date to epoch seconds
                     epoch_time = time.mktime(time.strptime(i[0], "%Y-%m-%d"))
-                    # print(epoch_time)
-                    # Update database, which isn't used in the GUI, but can be accessed for additional
-                    # analysis or graphing.
-                    self.calories_in_out_db.execute(
-                        "INSERT INTO CaloriesInOut (rec_date, epoch_time, CaloriesIn, CaloriesOut, "
-                        "CaloriesInMovingAverage, CaloriesOutMovingAverage) values(?, ?, ?, ?, ?, ?)"
-                        , [i[0], epoch_time, i[2], i[3], moving_average_kcals_in, moving_average_kcals_out])
+                    changed_days.append([i[0], epoch_time, i[2], i[3], i[4], i[5]])
 
-                    # print(f"{self.calories_in_out_db} {i[0]} {i[1]} {i[2]} {i[3]}")
+            with self.calories_in_out_db:
+                cursor = self.calories_in_out_db.executemany(
+                    "INSERT INTO CaloriesInOut (rec_date, epoch_time, CaloriesIn, CaloriesOut, "
+                    "CaloriesInMovingAverage, CaloriesOutMovingAverage) values(?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(rec_date) DO UPDATE SET CaloriesIn = excluded.CaloriesIn, "
+                    "CaloriesOut = excluded.CaloriesOut, CaloriesInMovingAverage = excluded.CaloriesInMovingAverage, "
+                    "CaloriesOutMovingAverage = excluded.CaloriesOutMovingAverage "
+                    "WHERE CaloriesIn != excluded.CaloriesIn OR CaloriesOut != excluded.CaloriesOut "
+                    "OR CaloriesInMovingAverage != excluded.CaloriesInMovingAverage "
+                    "OR CaloriesOutMovingAverage != excluded.CaloriesOutMovingAverage", changed_days)
 
-                self.calories_in_out_db.commit()
+            hlogger.info(f"CaloriesInOut updated {cursor.rowcount} of {len(changed_days)} days from "
+                         f"{first_changed_day}")
 
-                # print(f"{sorted_data}")
+            # print(f"{sorted_data}")
 
-                self.calorie_plotter.plot_save(sorted_data, 'calorie_history_graph.jpg')
+            # Rendered off the GUI thread, the graph is shown when it's done.
+            self.chart_renderer.submit('calorie_history', self.calorie_plotter.plot_save,
+                                       (sorted_data, self.graph_file), self.history_grapher.show_image)
 
             # Set up previous values that will be compared against.
             # self.last_calorie_history = calorie_history
-            self.prev_history_datetime = last_history_datetime
-            self.prev_expended_datetime = last_calorie_expended_datetime
+            self.prev_rollup_version = rollup_version
 
         # self.todays_calories_value_label.configure(text = (f"{self.todays_calories:.0f} kCal"))
         self.after(60 * 1000 * 3,
@@ -401,27 +402,27 @@ class CalorieHistoryFrame(ttk.Frame):
 # Class to manaage the history frame of the Application.
 class HistoryFrame:
 
-    def __init__(self, frame, google_fit_if):
+    def __init__(self, frame, chart_renderer):
         self.master_frame = frame
 
         config = configparser.ConfigParser()
         config.read('piscale.ini')
 
         # history_label = tk.Label(self.master_frame, text="History", fg="Black", font=("Helvetica", 15))
-        # Connection into the history data
-        self.history_db_con = sq.connect(f'{mod_path}/history.db')
 
         # There are two frames - table of calorie history and a graph of that data.
         self.calorie_history_frame = ttk.Frame(self.master_frame)
         self.graph_frame = ttk.Frame(self.master_frame)
 
+        # The graph is updated by the Calorie History whenever it re-plots.
+        history_grapher = HistoryGrapher(self.graph_frame)
+
         # Object for the Calorie History.
-        self.calorie_history = CalorieHistoryFrame(self.history_db_con, self.calorie_history_frame,
-                                                   int(config['calorie_history']['moving_average_days']), google_fit_if)
+        self.calorie_history = CalorieHistoryFrame(self.calorie_history_frame,
+                                                   int(config['calorie_history']['moving_average_days']),
+                                                   history_grapher, chart_renderer,
+                                                   config['calorie_history'].get('graph_file'))
         self.calorie_history.populate_history()
 
-        history_grapher = HistoryGrapher(self.graph_frame)
-        history_grapher.update_graph()
-
         self.calorie_history_frame.grid(column=0, row=0)
         self.graph_frame.grid(column=1, row=0)
@@ -0,0 +1,186 @@
+import time
+import statistics
+import threading
+
+import pigpio
+
+import logging
+
+logger = logging.getLogger('scaleLogger')
+
+# Extra clock pulses after the 24 data bits select the channel and gain of the next reading.
+gain_pulses = {128: 1,  # Channel A, gain 128
+               32: 2,  # Channel B, gain 32
+               64: 3}  # Channel A, gain 64
+
+# Passed in p3 to the read script, which can't leave it there (readings are 24 bit), so a changed p3 shows the script
+# has run. pigpio sends script parameters as unsigned 32 bit, so it can't be negative.
+read_sentinel = 0x1000000
+
+# How long a reading can take to clock out before giving up.
+read_timeout = 0.05
+
+# pigpio script that clocks out a reading. Runs inside the pigpio daemon, so the whole reading is one call rather than
+# a write and read round trip per bit - the clock high time stays well under the 60us that would power the HX711 down.
+#   p0 data pin, p1 clock pin, p2 extra pulses for the next gain. The 24 bit reading is left in p3.
+read_script = """
+ld v0 0
+ld v1 24
+tag 1
+w p1 1
+r p0
+sta v2
+lda v0
+mlt 2
+add v2
+sta v0
+w p1 0
+dcr v1
+lda v1
+jnz 1
+ld v1 p2
+tag 2
+w p1 1
+w p1 0
+dcr v1
+lda v1
+jnz 2
+lda v0
+sta p3
+"""
+
+
+# Driver for the HX711 load cell amplifier using the pigpio daemon, so it doesn't need the C++ HX711 library. Has the
+# same interface as the library's SimpleHX711 - read(), zero() and weight() - with weight() returning grams as a
+# float.
+#
+# Waits for the data pin to go low (reading ready) with a pigpio callback that sets an event, so a read returns as soon
+# as the reading is ready rather than busy polling or sleeping. The optional rate pin selects 80 samples per second if high, 10 if low - on boards that bring RATE out to a pin.
+class PigpioHX711:
+    def __init__(self, data_pin, clock_pin, ref_unit=1, offset=0, gain=128, rate_pin=None, fast_rate=False,
+                 host='localhost'):
+        self.data_pin = data_pin
+        self.clock_pin = clock_pin
+        self.ref_unit = ref_unit
+        self.offset = offset
+
+        self.pi = pigpio.pi(host)
+
+        if not self.pi.connected:
+            raise RuntimeError(f"Can't connect to the pigpio daemon on {host}")
+
+        self.pi.set_mode(self.data_pin, pigpio.INPUT)
+        self.pi.set_mode(self.clock_pin, pigpio.OUTPUT)
+
+        # Clock low powers the HX711 up.
+        self.pi.write(self.clock_pin, 0)
+
+        if rate_pin is not None:
+            self.pi.set_mode(rate_pin, pigpio.OUTPUT)
+            self.pi.write(rate_pin, 1 if fast_rate else 0)
+
+        # At 10 samples per second a reading is ready every 100ms - allow for a few being missed.
+        self.ready_timeout = 0.05 if fast_rate else 0.4
+
+        # Set when the data pin goes low, i.e. a reading is ready. The callback runs in pigpio's notification thread.
+        self.ready = threading.Event()
+        self.ready_callback = self.pi.callback(self.data_pin, pigpio.FALLING_EDGE, lambda gpio, level, tick:
+                                               self.ready.set())
+
+        self.script_id = self.pi.store_script(read_script.encode())
+
+        # The script has to be initialised in the daemon before it can be run.
+        while self.pi.script_status(self.script_id)[0] == pigpio.PI_SCRIPT_INITING:
+            time.sleep(0.001)
+
+        self.gain = None
+        self.set_gain(gain)
+
+        logger.info(f"pigpio HX711 on data {data_pin} clock {clock_pin} gain {gain} "
+                    f"{'80' if fast_rate else '10'} samples per second")
+
+    # Selects the channel and gain - 128 or 64 for channel A, 32 for channel B. Takes effect from the reading after
+    # next, so a reading is taken and thrown away.
+    def set_gain(self, gain):
+        if gain not in gain_pulses:
+            raise ValueError(f"HX711 gain must be one of {list(gain_pulses)}")
+
+        self.gain = gain
+        self.read_raw()
+
+    # Waits for the HX711 to have a reading ready, signalled by the data pin going low.
+    def wait_ready(self):
+        # Cleared before looking at the pin, so an edge after the look still sets it.
+        self.ready.clear()
+
+        if self.pi.read(self.data_pin) == 0:
+            return
+
+        if not self.ready.wait(self.ready_timeout):
+            # The notification can lag the pin, so have a last look.
+            if self.pi.read(self.data_pin) != 0:
+                raise TimeoutError("HX711 didn't have a reading ready")
+
+    # One reading, as a signed count.
+    def read_raw(self):
+        self.wait_ready()
+
+        self.pi.run_script(self.script_id, [self.data_pin, self.clock_pin, gain_pulses[self.gain], read_sentinel])
+
+        # The status can be read before the script has started, so it's done once it isn't running and has changed p3.
+        deadline = time.monotonic() + read_timeout
+
+        while True:
+            status, params = self.pi.script_status(self.script_id)
+
+            if status != pigpio.PI_SCRIPT_RUNNING and params[3] != read_sentinel:
+                break
+
+            if time.monotonic() > deadline:
+                raise TimeoutError("HX711 read script didn't finish")
+
+            time.sleep(0.0002)
+
+        reading = params[3] & 0xFFFFFF
+
+        # Readings are 24 bit two's complement.
+        if reading & 0x800000:
+            reading = reading - 0x1000000
+
+        return reading
+
+    # Median of a number of readings, like the library's default read strategy. Takes a sample count or the library's
+    # Options (only the number of samples is used).
+    def read(self, options=1):
+        samples = getattr(options, 'samples', options)
+
+        if samples == 1:
+            return self.read_raw()
+
+        return statistics.median(self.read_raw() for i in range(samples))
+
+    def zero(self, options=10):
+        self.offset = self.read(options)
+
+    # Weight in grams.
+    def weight(self, options=3):
+        return (self.read(options) - self.offset) / self.ref_unit
+
+    def getReferenceUnit(self):
+        return self.ref_unit
+
+    def setReferenceUnit(self, ref_unit):
+        self.ref_unit = ref_unit
+
+    def getOffset(self):
+        return self.offset
+
+    def setOffset(self, offset):
+        self.offset = offset
+
+    # Powers down the HX711 (clock held high) and frees up the daemon's resources.
+    def disconnect(self):
+        self.ready_callback.cancel()
+        self.pi.write(self.clock_pin, 1)
+        self.pi.delete_script(self.script_id)
+        self.pi.stop()
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+import pathlib
+
+import numpy
+
+import logging
+
+logger = logging.getLogger('scaleLogger')
+
+# Recording file format - a 16 byte header followed by fixed size records of the sample time (seconds since the epoch)
+# and the raw reading, all little endian. The records can be memory mapped straight into a numpy array.
+file_magic = b'PISCSAMP'
+file_version = 1
+header_dtype = numpy.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4')])
+record_dtype = numpy.dtype([('t', '<f8'), ('raw', '<i4')])
+
+
+# Records raw scale samples to files for tuning the filters offline. Samples are buffered and written a block at a time
+# so recording costs the sampling loop next to nothing. A new file is started when the current one would go over
+# max_bytes. Files are named <prefix>_<date>_<time>.bin in record_dir.
+#
+# close() can be called from another thread (e.g. at exit) to write out what is buffered.
+class SampleRecorder:
+    def __init__(self, record_dir, prefix='scale', max_bytes=10 * 1024 * 1024, buffer_records=512):
+        self.record_dir = pathlib.Path(record_dir)
+        self.record_dir.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.max_records = max(1, (max_bytes - header_dtype.itemsize) // record_dtype.itemsize)
+
+        self.buffer = numpy.zeros(buffer_records, dtype=record_dtype)
+        self.buffered = 0
+
+        self.file = None
+        self.file_name = None
+        self.file_records = 0
+
+        # Sample times are from time.monotonic(), recorded as time since the epoch.
+        self.epoch_offset = time.time() - time.monotonic()
+
+        self.lock = threading.Lock()
+
+    # Add a sample, time from time.monotonic().
+    def add(self, sample_time, raw):
+        with self.lock:
+            self.buffer[self.buffered] = (sample_time + self.epoch_offset, round(raw))
+            self.buffered = self.buffered + 1
+
+            if self.buffered == len(self.buffer):
+                self.flush()
+
+    # Write the buffered samples out, starting new files as needed. Called with the lock held.
+    def flush(self):
+        written = 0
+
+        while written < self.buffered:
+            if self.file is None or self.file_records == self.max_records:
+                self.new_file()
+
+            count = min(self.buffered - written, self.max_records - self.file_records)
+            self.buffer[written:written + count].tofile(self.file)
+            self.file_records = self.file_records + count
+            written = written + count
+
+        self.file.flush()
+        self.buffered = 0
+
+    def new_file(self):
+        self.close_file()
+
+        self.file_name = self.record_dir / f"{self.prefix}_{time.strftime('%Y%m%d_%H%M%S')}.bin"
+
+        # Don't overwrite if files are rotating quicker than once a second.
+        suffix = 1
+        while self.file_name.exists():
+            self.file_name = self.record_dir / f"{self.prefix}_{time.strftime('%Y%m%d_%H%M%S')}_{suffix}.bin"
+            suffix = suffix + 1
+
+        self.file = open(self.file_name, 'wb')
+        numpy.array((file_magic, file_version, record_dtype.itemsize), dtype=header_dtype).tofile(self.file)
+        self.file_records = 0
+
+        logger.info(f"Recording samples to {self.file_name}")
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        with self.lock:
+            if self.buffered:
+                self.flush()
+
+            self.close_file()
+
+
+# Reads a recording, returning numpy arrays of the sample times (seconds since the epoch) and raw readings. The arrays
+# are memory mapped, so even large recordings are quick to open. A partly written last record is ignored.
+def read_samples(file_name):
+    header = numpy.fromfile(file_name, dtype=header_dtype, count=1)
+
+    if len(header) == 0 or header[0]['magic'] != file_magic or header[0]['version'] != file_version:
+        raise ValueError(f"{file_name} isn't a scale sample recording")
+
+    records = (os.path.getsize(file_name) - header_dtype.itemsize) // record_dtype.itemsize
+
+    if records == 0:
+        return numpy.zeros(0), numpy.zeros(0, dtype='<i4')
+
+    samples = numpy.memmap(file_name, dtype=record_dtype, mode='r', offset=header_dtype.itemsize, shape=(records,))
+
+    return samples['t'], samples['raw']
@@ -0,0 +1,195 @@
+import time
+import random
+
+import sample_recorder
+
+import logging
+
+logger = logging.getLogger('scaleLogger')
+
+
+# Where the raw scale samples come from. read() waits for and returns the next raw reading, in counts, like the
+# HX711 does - so the rest of the scale code runs the same whether it is on the Raspberry Pi or not.
+class ScaleBackend:
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# The real HX711, through the C++ HX711 library or the pigpio driver. Only the driver used is imported, so the
+# other backends work without either installed.
+class HX711Backend(ScaleBackend):
+    def __init__(self, data_pin, clock_pin, ref_unit, offset, driver='library', gain=128, rate_pin=None,
+                 fast_rate=False):
+        if driver == 'library':
+            # HX711 library for the scale interface.
+            import HX711 as HX
+
+            # The library only takes whole numbers. Its conversion to grams isn't used - read() returns raw counts and
+            # the calibration, which can be fractional, is applied by WeightAcquisition - so rounding them is harmless.
+            self.hx = HX.SimpleHX711(data_pin, clock_pin, int(round(ref_unit)) or 1, int(round(offset)))
+            self.read_options = HX.Options(1)
+        elif driver == 'pigpio':
+            import hx711_pigpio
+
+            self.hx = hx711_pigpio.PigpioHX711(data_pin, clock_pin, ref_unit, offset, gain=gain, rate_pin=rate_pin,
+                                               fast_rate=fast_rate)
+            self.read_options = 1
+        else:
+            raise ValueError(f"Unknown scale driver {driver}")
+
+    def read(self):
+        return self.hx.read(self.read_options)
+
+    def close(self):
+        if hasattr(self.hx, 'disconnect'):
+            self.hx.disconnect()
+
+
+# Made up readings for running off the Raspberry Pi. Gaussian noise, a slow drift of the zero and a repeating
+# sequence of loads, each a (seconds from the start of the sequence, grams) pair. set_load() puts a load on by hand.
+class SimulatedBackend(ScaleBackend):
+    def __init__(self, ref_unit, offset, sample_rate=10.0, noise_g=1.0, drift_g_per_hour=0.0, steps=None,
+                 realtime=True, seed=None):
+        self.ref_unit = ref_unit
+        self.offset = offset
+        self.sample_period = 1 / sample_rate
+        self.noise_g = noise_g
+        self.drift_g_per_sample = drift_g_per_hour / 3600 * self.sample_period
+        self.steps = sorted(steps) if steps else []
+        self.realtime = realtime
+        self.random = random.Random(seed)
+
+        self.load = 0.0
+        self.samples = 0
+        self.next_sample_time = time.monotonic()
+
+    def set_load(self, grams):
+        self.load = grams
+
+    # Load at the given time into the step sequence, which repeats a second after its last step.
+    def step_load(self, elapsed):
+        elapsed = elapsed % (self.steps[-1][0] + 1)
+        load = self.steps[0][1]
+
+        for start, grams in self.steps:
+            if start <= elapsed:
+                load = grams
+
+        return load
+
+    def read(self):
+        # Pace the readings like the real thing.
+        if self.realtime:
+            self.next_sample_time = self.next_sample_time + self.sample_period
+            delay = self.next_sample_time - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+
+        if self.steps:
+            self.load = self.step_load(self.samples * self.sample_period)
+
+        grams = self.load + self.samples * self.drift_g_per_sample + self.random.gauss(0, self.noise_g)
+        self.samples = self.samples + 1
+
+        return round(self.offset + grams * self.ref_unit)
+
+
+# Plays back raw readings recorded from the scale - either a .bin recording from SampleRecorder or a text file with a
+# reading per line, "time raw" or just "raw". Times are in seconds and are used to pace the playback, otherwise
+# readings come at sample_rate.
+class ReplayBackend(ScaleBackend):
+    def __init__(self, file_name, sample_rate=10.0, realtime=True, loop=True):
+        self.times, self.raw = self.load(file_name, 1 / sample_rate)
+        self.realtime = realtime
+        self.loop = loop
+        self.index = 0
+        self.start_time = None
+
+        if not self.raw:
+            raise ValueError(f"No readings in {file_name}")
+
+        logger.info(f"Replaying {len(self.raw)} readings from {file_name}")
+
+    @staticmethod
+    def load(file_name, sample_period):
+        if str(file_name).endswith('.bin'):
+            times, raw = sample_recorder.read_samples(file_name)
+
+            if len(times) == 0:
+                return [], []
+
+            return (times - times[0]).tolist(), raw.tolist()
+
+        times = []
+        raw = []
+
+        with open(file_name) as replay_file:
+            for line in replay_file:
+                fields = line.split()
+
+                if not fields or fields[0].startswith('#'):
+                    continue
+
+                times.append(float(fields[0]) if len(fields) > 1 else len(raw) * sample_period)
+                raw.append(float(fields[-1]))
+
+        return times, raw
+
+    def read(self):
+        if self.index == len(self.raw):
+            if not self.loop:
+                raise EOFError("End of replay")
+
+            self.index = 0
+            self.start_time = None
+
+        if self.realtime:
+            if self.start_time is None:
+                self.start_time = time.monotonic() - self.times[self.index]
+
+            delay = self.start_time + self.times[self.index] - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+
+        reading = self.raw[self.index]
+        self.index = self.index + 1
+
+        return reading
+
+
+# Parses the simulated steps setting - comma separated seconds:grams pairs.
+def parse_steps(steps):
+    return [(float(start), float(grams)) for start, grams in
+            (step.split(':') for step in steps.split(',') if step.strip())]
+
+
+# Creates the backend set in the scale section of piscale.ini.
+def create_backend(scale_config, data_pin, clock_pin, ref_unit, offset):
+    backend = scale_config.get('backend', 'hx711')
+
+    logger.info(f"Scale backend {backend}")
+
+    if backend == 'hx711':
+        rate_pin = scale_config.get('rate_pin', '')
+        return HX711Backend(data_pin, clock_pin, ref_unit, offset,
+                            driver=scale_config.get('driver', 'library'),
+                            gain=scale_config.getint('gain', 128),
+                            rate_pin=int(rate_pin) if rate_pin else None,
+                            fast_rate=scale_config.getboolean('fast_rate', False))
+    elif backend == 'simulated':
+        return SimulatedBackend(ref_unit, offset,
+                                sample_rate=scale_config.getfloat('sample_rate', 10.0),
+                                noise_g=scale_config.getfloat('simulated_noise_g', 1.0),
+                                drift_g_per_hour=scale_config.getfloat('simulated_drift_g_per_hour', 0.0),
+                                steps=parse_steps(scale_config.get('simulated_steps', '')))
+    elif backend == 'replay':
+        return ReplayBackend(scale_config['replay_file'],
+                             sample_rate=scale_config.getfloat('sample_rate', 10.0),
+                             loop=scale_config.getboolean('replay_loop', True))
+
+    raise ValueError(f"Unknown scale backend {backend}")
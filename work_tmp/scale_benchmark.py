@@ -0,0 +1,83 @@
+# Benchmarks the scale filtering and settling without the scale or GUI, using the simulated or replay backend as fast
+# as they will go. Reports how fast the filter chain in piscale.ini runs and how long the weight takes to settle.
+#
+# Usage: python3 scale_benchmark.py [replay_file]
+import sys
+import time
+import configparser
+import logging
+
+import numpy
+
+import scale_backends
+import weight_filters
+import weight_acquisition
+import scale_calibration
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+
+config = configparser.ConfigParser()
+config.read('piscale.ini')
+
+ref_unit, offset, linearity = scale_calibration.load_calibration(config, weight_acquisition.ref_unit,
+                                                                 weight_acquisition.initial_offset)
+sample_rate = config['scale'].getfloat('sample_rate', 10.0)
+
+# Samples handled per update - about what the display gets between updates.
+batch_size = 6
+num_samples = 6000
+
+if len(sys.argv) > 1:
+    backend = scale_backends.ReplayBackend(sys.argv[1], sample_rate, realtime=False, loop=False)
+else:
+    backend = scale_backends.SimulatedBackend(ref_unit, offset, sample_rate,
+                                              noise_g=config['scale'].getfloat('simulated_noise_g', 1.0),
+                                              drift_g_per_hour=config['scale'].getfloat('simulated_drift_g_per_hour',
+                                                                                        0.0),
+                                              steps=scale_backends.parse_steps(config['scale']['simulated_steps']),
+                                              realtime=False, seed=1)
+
+raw = []
+
+try:
+    for i in range(num_samples):
+        raw.append(backend.read())
+except EOFError:
+    pass
+
+raw = numpy.array(raw, dtype=float)
+
+filter_chain = weight_filters.filter_chain_from_config(config['scale_filter'], abs(ref_unit))
+stability = weight_filters.StabilityDetector(config['scale_stability'].getint('window', 10),
+                                             config['scale_stability'].getfloat('max_std_g', 1.0))
+
+# Sample number of each settled/unsettled event.
+events = []
+batch = 0
+stability.add_listener(lambda event, weight: events.append((event, batch * batch_size, weight)))
+
+update_times = []
+
+for batch in range(len(raw) // batch_size):
+    start = time.perf_counter()
+    filtered = filter_chain.process(raw[batch * batch_size:(batch + 1) * batch_size])
+    stability.process(scale_calibration.raw_to_grams(filtered, ref_unit, offset, linearity))
+    update_times.append(time.perf_counter() - start)
+
+update_times = numpy.array(update_times)
+
+print(f"{len(raw)} samples in batches of {batch_size}")
+# The first update includes numpy warming up, so is reported on its own.
+print(f"Filter and stability per update: mean {update_times[1:].mean() * 1e6:.0f}us, "
+      f"max {update_times[1:].max() * 1e6:.0f}us, first {update_times[0] * 1e6:.0f}us, "
+      f"{batch_size / update_times[1:].mean():.0f} samples/s")
+
+# Time from the weight going unsettled to it settling again.
+settle_times = [(settled[1] - unsettled[1]) / sample_rate for unsettled, settled in zip(events, events[1:])
+                if unsettled[0] == 'unsettled' and settled[0] == 'settled']
+
+if settle_times:
+    print(f"Settled {len(settle_times)} times, taking mean {numpy.mean(settle_times):.2f}s, "
+          f"max {numpy.max(settle_times):.2f}s")
+
+print(f"Settled weights {sorted({round(weight) for event, sample, weight in events if event == 'settled'})}")
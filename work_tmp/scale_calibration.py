@@ -0,0 +1,142 @@
+# Calibrates the scale from readings of known weights. Fits raw = offset + ref_unit * grams, optionally with a
+# linearity term (+ linearity * grams ** 2), by least squares and saves the result to the scale_calibration section of
+# piscale.ini, which is loaded at startup.
+#
+# Usage: python3 scale_calibration.py [--quadratic] [--samples N] [--dry-run] weight_g weight_g ...
+#   e.g. python3 scale_calibration.py 0 100 200 500 1000
+import argparse
+import configparser
+import re
+
+import numpy
+
+import scale_backends
+import weight_acquisition
+
+import logging
+
+logger = logging.getLogger('scaleLogger')
+
+calibration_section = 'scale_calibration'
+
+
+# Least squares fit of the raw readings to the known weights in grams. Returns ref_unit, offset and linearity (0 for a
+# straight line fit) along with the residual of each reading in grams.
+def fit_calibration(weights, raw_readings, quadratic=False):
+    weights = numpy.asarray(weights, dtype=float)
+    raw_readings = numpy.asarray(raw_readings, dtype=float)
+
+    columns = [numpy.ones_like(weights), weights]
+
+    if quadratic:
+        columns.append(weights ** 2)
+
+    if len(weights) < len(columns):
+        raise ValueError(f"Need at least {len(columns)} weights for the fit")
+
+    coefficients = numpy.linalg.lstsq(numpy.column_stack(columns), raw_readings, rcond=None)[0]
+
+    offset, ref_unit = coefficients[:2]
+    linearity = coefficients[2] if quadratic else 0.0
+
+    residuals = raw_to_grams(raw_readings, ref_unit, offset, linearity) - weights
+
+    return ref_unit, offset, linearity, residuals
+
+
+# Converts raw readings to grams, the inverse of the calibration. With a linearity term this is the root of the
+# quadratic nearest the straight line, in a form that doesn't lose precision when the term is small.
+def raw_to_grams(raw, ref_unit, offset, linearity=0.0):
+    difference = numpy.asarray(raw, dtype=float) - offset
+
+    if linearity == 0:
+        return difference / ref_unit
+
+    return 2 * difference / (ref_unit + numpy.sign(ref_unit) *
+                             numpy.sqrt(ref_unit ** 2 + 4 * linearity * difference))
+
+
+# The calibration from piscale.ini, falling back to the given defaults if the scale hasn't been calibrated.
+def load_calibration(config, default_ref_unit, default_offset):
+    if not config.has_section(calibration_section):
+        return default_ref_unit, default_offset, 0.0
+
+    calibration = config[calibration_section]
+
+    return (calibration.getfloat('ref_unit', default_ref_unit), calibration.getfloat('offset', default_offset),
+            calibration.getfloat('linearity', 0.0))
+
+
+# Writes the calibration to the scale_calibration section of the config file. The rest of the file is left as it is
+# (configparser would lose the comments), the section is replaced or added to the end.
+def save_calibration(config_file, ref_unit, offset, linearity):
+    section = (f"[{calibration_section}]\n"
+               f"# Set by scale_calibration.py - raw = offset + ref_unit * grams + linearity * grams ** 2\n"
+               f"ref_unit = {ref_unit:.6f}\n"
+               f"offset = {offset:.1f}\n"
+               f"linearity = {linearity:.6g}\n")
+
+    with open(config_file, newline='') as ini_file:
+        text = ini_file.read()
+
+    newline = '\r\n' if '\r\n' in text else '\n'
+    text = text.replace('\r\n', '\n')
+
+    existing = re.compile(rf"^\[{calibration_section}\]\n(?:(?!\[).*\n?)*", re.MULTILINE)
+
+    if existing.search(text):
+        text = existing.sub(lambda match: section + ('\n' if match.group(0).endswith('\n\n') else ''), text)
+    else:
+        text = text.rstrip('\n') + '\n\n' + section
+
+    with open(config_file, 'w', newline='') as ini_file:
+        ini_file.write(text.replace('\n', newline))
+
+
+# Average raw reading of the backend over a number of samples.
+def average_reading(backend, samples):
+    return float(numpy.mean([backend.read() for i in range(samples)]))
+
+
+def calibrate():
+    parser = argparse.ArgumentParser(description="Calibrate the scale with known weights")
+    parser.add_argument('weights', type=float, nargs='+', help="known weights in grams, e.g. 0 100 500 1000")
+    parser.add_argument('--quadratic', action='store_true', help="also fit a linearity term")
+    parser.add_argument('--samples', type=int, default=50, help="readings averaged for each weight")
+    parser.add_argument('--dry-run', action='store_true', help="don't save the result to piscale.ini")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('piscale.ini')
+
+    ref_unit, offset, linearity = load_calibration(config, weight_acquisition.ref_unit,
+                                                   weight_acquisition.initial_offset)
+    backend = scale_backends.create_backend(config['scale'], weight_acquisition.data_pin,
+                                            weight_acquisition.clock_pin, ref_unit, offset)
+
+    raw_readings = []
+
+    for weight in args.weights:
+        input(f"Put {weight:g}g on the scale and press Enter")
+        raw_readings.append(average_reading(backend, args.samples))
+        print(f"  {raw_readings[-1]:.1f}")
+
+    backend.close()
+
+    ref_unit, offset, linearity, residuals = fit_calibration(args.weights, raw_readings, args.quadratic)
+
+    print(f"ref_unit {ref_unit:.6f} offset {offset:.1f} linearity {linearity:.6g}")
+
+    for weight, residual in zip(args.weights, residuals):
+        print(f"  {weight:g}g off by {residual:+.2f}g")
+
+    print(f"RMS error {numpy.sqrt(numpy.mean(residuals ** 2)):.2f}g")
+
+    if not args.dry_run:
+        save_calibration('piscale.ini', ref_unit, offset, linearity)
+        print("Saved to piscale.ini")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    calibrate()
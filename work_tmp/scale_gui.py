@@ -1,15 +1,14 @@
 #!/usr/bin python3
 
 import sys
+import time
 import tkinter as tk
 from tkinter import ttk
 import pathlib
+import configparser
 from PIL import Image, ImageTk
 import cProfile
 
-# HX711 library for the scale interface.
-import HX711 as HX
-
 # Import the history frame classes
 import history
 
@@ -17,6 +16,8 @@ import history
 import body_weight
 import google_fit_if
 import daily
+import chart_render
+import weight_acquisition
 import config  # some globals to use.
 import logging.config
 
@@ -28,36 +29,6 @@ logger.setLevel(logging.DEBUG)
 
 mod_path = pathlib.Path(__file__).parent
 
-class Weight:
-    def __init__(self):
-        self.weight = None
-
-        # Connect to the scale and zero it out.
-        # create a SimpleHX711 object using GPIO pin 14 as the data pin,
-        # GPIO pin 15 as the clock pin, -370 as the reference unit, and
-        # -367471 as the offset
-        # This will likely have to change if using a different scale.
-        self.hx = HX.SimpleHX711(14, 15, int(-370 / 1.244 / 1.00314), -367471)
-        self.hx.zero()
-
-    # Zero out the scale
-    def zero(self):
-        self.hx.zero()
-
-    # Update the weight display - do this regular.
-    def update_weight(self):
-        # Get the current weight on the scale
-        weight_str = str(self.hx.weight(5))
-        # print(weight_str)
-        self.weight = float(weight_str[:-2])
-
-        # Ignore any negative weight greater than 2g - avoids flicker of -ve sign.
-        if 2 > self.weight > -2:
-            self.weight = 0
-
-    def get_weight(self):
-        return self.weight
-
 # Main Application for the Scale GUI
 class App(ttk.Frame):
     def __init__(self, master=None):
@@ -68,7 +39,7 @@ class App(ttk.Frame):
         ttk.Frame.__init__(self, master)
 
         self.selected_item_cal_label = None
-        self.weight = Weight()
+        self.weight = weight_acquisition.Weight()
 
         self.master = master
 
@@ -77,6 +48,19 @@ class App(ttk.Frame):
 
         # Initialise the old weight. Old weight is used to determine if display update is needed.
         self.old_weight = None
+        self.showing_taring = False
+
+        # The weight display is updated quickly while the weight is changing, backing off to a slow rate when idle.
+        ini = configparser.ConfigParser()
+        ini.read('piscale.ini')
+        self.fast_display_interval_ms = ini['weight_display'].getint('fast_interval_ms', 75)
+        self.max_display_interval_ms = ini['weight_display'].getint('max_interval_ms', 3000)
+        self.display_backoff = ini['weight_display'].getfloat('backoff', 1.5)
+        self.unsettled_fast_s = ini['weight_display'].getfloat('unsettled_fast_s', 2.0)
+        self.display_interval_ms = self.fast_display_interval_ms
+
+        # When the displayed weight last changed.
+        self.display_change_time = time.monotonic()
 
         # Update the weight, which will happen regularly after this call.
         style.configure('piscale.TLabel', font=('Helvetica', 10))
@@ -144,30 +128,61 @@ class App(ttk.Frame):
         google_fit_if_obj.daemon = True
         google_fit_if_obj.start()
 
+        # Charts are rendered on their own thread so the GUI doesn't stall while they are drawn.
+        self.chart_renderer = chart_render.ChartRenderWorker()
+        self.chart_renderer.daemon = True
+        self.chart_renderer.start()
+        self.chart_renderer.poll_results(self)
+
         # Create the calorie history and body weight frames.
 
-        # Calorie history includes the Google Fit Object as it has the data for expended calories.
-        self.history_frame_hdl = history.HistoryFrame(history_frame, google_fit_if_obj)
+        # Calorie history reads the daily rollup, which the Google Fit Object keeps up to date with expended calories.
+        self.history_frame_hdl = history.HistoryFrame(history_frame, self.chart_renderer)
 
         # Body weight frame contains the measurements for the body weight from the bathroom scale.
-        self.body_weight_frame_hdl = body_weight.BodyWeightFrame(body_weight_frame)
+        self.body_weight_frame_hdl = body_weight.BodyWeightFrame(body_weight_frame, self.chart_renderer)
 
         self.update_weight_display()
 
-    # Update the display of the weight - happens regularly.
+    # Update the display of the weight - happens regularly, more often while the weight is changing.
     def update_weight_display(self):
 
         self.weight.update_weight()
         curr_weight = self.weight.get_weight()
 
+        if self.weight.taring():
+            # Show the scale is being zeroed, the weight is shown again once it's done.
+            if not self.showing_taring:
+                self.weight_disp.configure(text="Taring")
+                self.showing_taring = True
+                self.old_weight = None
+
+            changed = True
+
         # Update the weight display only if it has changed.
-        if self.old_weight is None or abs(self.old_weight - curr_weight) > 2.0:
+        elif self.old_weight is None or abs(self.old_weight - curr_weight) > 2.0:
             weight_display = f"{float(curr_weight):03.0f}g"
             logger.debug(f"Updating weight display {weight_display} used to be {self.old_weight}")
             self.weight_disp.configure(text=weight_display)
             self.old_weight = curr_weight
-
-        self.after(600, self.update_weight_display)
+            self.showing_taring = False
+            changed = True
+        else:
+            changed = False
+
+        if changed:
+            self.display_change_time = time.monotonic()
+
+        # Stays fast for a while after a change if the weight hasn't settled, as it is likely to change again - but
+        # not for ever, as noise can keep an idle scale from ever settling.
+        if changed or (not self.weight.is_settled() and
+                       time.monotonic() - self.display_change_time < self.unsettled_fast_s):
+            self.display_interval_ms = self.fast_display_interval_ms
+        else:
+            self.display_interval_ms = min(round(self.display_interval_ms * self.display_backoff),
+                                           self.max_display_interval_ms)
+
+        self.after(self.display_interval_ms, self.update_weight_display)
 
     # Exit function
     @staticmethod
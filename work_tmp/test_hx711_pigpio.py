@@ -0,0 +1,75 @@
+import struct
+import sys
+import types
+import unittest
+
+
+# Stands in for the pigpio daemon connection. Script parameters are packed the way pigpio's run_script sends them to
+# the daemon, so a value the real library would reject fails here too.
+class FakePi:
+    connected = True
+
+    def __init__(self, host='localhost'):
+        self.params = [0] * 10
+        self.readings = []
+
+    def set_mode(self, gpio, mode):
+        pass
+
+    def write(self, gpio, level):
+        pass
+
+    def read(self, gpio):
+        # Data pin low - a reading is always ready.
+        return 0
+
+    def callback(self, gpio, edge, function):
+        return types.SimpleNamespace(cancel=lambda: None)
+
+    def store_script(self, script):
+        return 0
+
+    def run_script(self, script_id, params):
+        packed = b''.join(struct.pack('I', param) for param in params)
+        self.params[:len(params)] = struct.unpack(f'{len(params)}I', packed)
+        self.params[3] = self.readings.pop(0) if self.readings else 0
+
+    def script_status(self, script_id):
+        # Status and parameters come back as signed 32 bit, as from pigpio.
+        return pigpio.PI_SCRIPT_HALTED, list(struct.unpack('10i', struct.pack('10I', *self.params)))
+
+    def delete_script(self, script_id):
+        pass
+
+    def stop(self):
+        pass
+
+
+pigpio = types.ModuleType('pigpio')
+pigpio.INPUT = 0
+pigpio.OUTPUT = 1
+pigpio.FALLING_EDGE = 1
+pigpio.PI_SCRIPT_INITING = 0
+pigpio.PI_SCRIPT_HALTED = 1
+pigpio.PI_SCRIPT_RUNNING = 2
+pigpio.pi = FakePi
+sys.modules['pigpio'] = pigpio
+
+import hx711_pigpio
+
+
+class PigpioHX711Test(unittest.TestCase):
+    def test_script_params_can_be_sent(self):
+        for gain in hx711_pigpio.gain_pulses:
+            hx = hx711_pigpio.PigpioHX711(14, 15, gain=gain)
+            hx.read_raw()
+
+    def test_readings_are_signed_24_bit(self):
+        hx = hx711_pigpio.PigpioHX711(14, 15)
+        hx.pi.readings = [0x7FFFFF, 0x800000, 0xFFFFFF, 0x000010]
+
+        self.assertEqual([hx.read_raw() for i in range(4)], [0x7FFFFF, -0x800000, -1, 0x10])
+
+
+if __name__ == '__main__':
+    unittest.main()
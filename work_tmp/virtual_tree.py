@@ -0,0 +1,142 @@
+from tkinter import ttk
+
+
+# Treeview that shows a long list of rows without inserting them all into Tk. The rows are held in a Python list (the
+# row store) and the tree only ever holds enough items to fill its visible height. Scrolling doesn't add or remove
+# items - it re-fills the same items with the rows that are now in view, so a list of thousands of foods costs the
+# same to show and scroll as a list of 16.
+#
+# The scrollbar and mouse wheel drive the window through yview(). Selection is tracked by row rather than by tree
+# item, so the selected row survives being scrolled out of view - use selected_values() rather than selection().
+class VirtualTreeview(ttk.Treeview):
+    def __init__(self, master, row_format=None, **kw):
+        ttk.Treeview.__init__(self, master, **kw)
+
+        # Function taking (row, row index) and returning (values, tags) for the tree. Defaults to the row as is.
+        self.row_format = row_format
+
+        self.visible_rows = int(kw.get('height', 10))
+        self.rows = []
+        self.first_row = 0
+        self.selected_row = None
+        self.scrollbar = None
+
+        self.bind('<<TreeviewSelect>>', self.selection_changed)
+        self.bind('<MouseWheel>', self.mouse_wheel)
+        self.bind('<Button-4>', lambda event: self.scroll_rows(-3))
+        self.bind('<Button-5>', lambda event: self.scroll_rows(3))
+        self.bind('<Up>', lambda event: self.move_selection(-1))
+        self.bind('<Down>', lambda event: self.move_selection(1))
+
+    # Connect the vertical scrollbar - use instead of yscrollcommand as the tree's own scroll position isn't used.
+    def set_scrollbar(self, scrollbar):
+        self.scrollbar = scrollbar
+        scrollbar.config(command=self.yview)
+        self.update_scrollbar()
+
+    # Replace the row store and show the top of the list.
+    def set_rows(self, rows):
+        self.rows = rows
+        self.first_row = 0
+        self.selected_row = None
+        self.refresh()
+
+    # Values of the selected row, or None if nothing is selected.
+    def selected_values(self):
+        if self.selected_row is None:
+            return None
+
+        return self.format_row(self.selected_row)[0]
+
+    def format_row(self, index):
+        if self.row_format is None:
+            return self.rows[index], ()
+
+        return self.row_format(self.rows[index], index)
+
+    # Fill the tree items with the rows in the current window. Items are reused, only added or removed when the
+    # number of rows in view changes.
+    def refresh(self):
+        items = self.get_children()
+        count = max(0, min(self.visible_rows, len(self.rows) - self.first_row))
+
+        if len(items) > count:
+            self.delete(*items[count:])
+
+        for slot in range(count):
+            values, tags = self.format_row(self.first_row + slot)
+
+            if slot < len(items):
+                self.item(items[slot], values=values, tags=tags)
+            else:
+                self.insert(parent='', index='end', iid=f'row{slot}', values=values, tags=tags)
+
+        # Highlight the selected row if it is in view.
+        if self.selected_row is not None and 0 <= self.selected_row - self.first_row < count:
+            self.selection_set(f'row{self.selected_row - self.first_row}')
+        elif self.selection():
+            self.selection_remove(*self.selection())
+
+        self.update_scrollbar()
+
+    # Track the selected row as the user clicks on items.
+    def selection_changed(self, event=None):
+        selected = self.selection()
+
+        if selected:
+            self.selected_row = self.first_row + self.index(selected[0])
+        elif self.selected_row is not None and 0 <= self.selected_row - self.first_row < self.visible_rows:
+            # Selection was cleared while the row was in view - otherwise it has just been scrolled out of view.
+            self.selected_row = None
+
+    # Scrollbar interface - same arguments as Treeview.yview.
+    def yview(self, *args):
+        if not args:
+            return self.window_fractions()
+
+        if args[0] == 'moveto':
+            self.scroll_to(round(float(args[1]) * len(self.rows)))
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if args[2] == 'pages':
+                amount = amount * self.visible_rows
+            self.scroll_rows(amount)
+
+    def scroll_rows(self, amount):
+        self.scroll_to(self.first_row + amount)
+
+    def scroll_to(self, first_row):
+        first_row = max(0, min(first_row, len(self.rows) - self.visible_rows))
+
+        if first_row != self.first_row:
+            self.first_row = first_row
+            self.refresh()
+
+    def mouse_wheel(self, event):
+        self.scroll_rows(-3 if event.delta > 0 else 3)
+
+    # Keyboard selection that scrolls the window at the top and bottom of the view.
+    def move_selection(self, step):
+        if not self.rows:
+            return 'break'
+
+        row = 0 if self.selected_row is None else max(0, min(self.selected_row + step, len(self.rows) - 1))
+        self.selected_row = row
+
+        if row < self.first_row:
+            self.first_row = row
+        elif row >= self.first_row + self.visible_rows:
+            self.first_row = row - self.visible_rows + 1
+
+        self.refresh()
+        return 'break'
+
+    def window_fractions(self):
+        if not self.rows:
+            return 0.0, 1.0
+
+        return self.first_row / len(self.rows), min(1.0, (self.first_row + self.visible_rows) / len(self.rows))
+
+    def update_scrollbar(self):
+        if self.scrollbar is not None:
+            self.scrollbar.set(*self.window_fractions())
@@ -0,0 +1,268 @@
+import threading
+import time
+import atexit
+
+import configparser
+
+import numpy
+
+import weight_filters
+import scale_backends
+import sample_recorder
+import scale_calibration
+
+import logging
+
+logger = logging.getLogger('scaleLogger')
+
+# GPIO pin 14 is the data pin, GPIO pin 15 the clock pin. -370 is the reference unit (raw counts per gram) and -367471
+# the offset. These are only used until the scale has been calibrated with scale_calibration.py, which saves its
+# values in piscale.ini.
+data_pin = 14
+clock_pin = 15
+ref_unit = int(-370 / 1.244 / 1.00314)
+initial_offset = -367471
+
+# Number of raw samples kept and the number averaged to zero the scale.
+buffer_size = 256
+zero_samples = 5
+
+
+# Reads the scale backend continuously on its own thread, keeping the latest raw samples in a fixed size ring buffer.
+# Readers never wait on the scale - they take the samples already buffered.
+#
+# The HX711 driver's weight() and zero() aren't used, as they block for several samples. Raw readings are converted
+# here with the same reference unit and an offset that is kept here.
+class WeightAcquisition(threading.Thread):
+    def __init__(self, backend, ref_unit, offset, linearity=0.0, size=buffer_size, recorder=None):
+        threading.Thread.__init__(self)
+
+        self.backend = backend
+
+        # Optional SampleRecorder that every raw sample is also written to.
+        self.recorder = recorder
+        self.ref_unit = ref_unit
+        self.offset = offset
+        self.linearity = linearity
+
+        # Ring buffer of sample times and raw readings. sample_count is the total ever read, so the latest sample is
+        # at (sample_count - 1) % size.
+        self.times = numpy.zeros(size)
+        self.raw = numpy.zeros(size)
+        self.sample_count = 0
+
+        # Samples to be averaged for a zero, those still to come and their running total.
+        self.zero_samples = 0
+        self.zero_remaining = 0
+        self.zero_total = 0.0
+
+        self.lock = threading.Lock()
+
+    # Zero (tare) the scale without waiting. If the latest buffered samples are steady - their spread is within
+    # max_spread counts - the new offset is their average, straight away. Otherwise the next samples are averaged once
+    # they come in, and zeroing() is True until then.
+    def zero(self, samples=zero_samples, max_spread=None):
+        with self.lock:
+            available = min(self.sample_count, len(self.raw))
+
+            if max_spread is not None and available >= samples:
+                recent = self.raw[numpy.arange(self.sample_count - samples, self.sample_count) % len(self.raw)]
+
+                if recent.std() <= max_spread:
+                    self.offset = recent.mean()
+                    self.zero_remaining = 0
+                    logger.info(f"Scale zeroed from buffered samples, offset {self.offset:.0f}")
+                    return
+
+            self.zero_samples = samples
+            self.zero_remaining = samples
+            self.zero_total = 0.0
+
+    def zeroing(self):
+        return self.zero_remaining > 0
+
+    # Thread's run function - reads the scale as fast as it supplies samples.
+    def run(self):
+        logger.info("Weight acquisition started")
+
+        while True:
+            try:
+                raw = self.backend.read()
+            except EOFError:
+                logger.info("No more samples from the scale")
+                return
+            except Exception:
+                logger.exception("Failed to read the scale")
+                time.sleep(1)
+                continue
+
+            sample_time = time.monotonic()
+
+            if self.recorder is not None:
+                self.recorder.add(sample_time, raw)
+
+            with self.lock:
+                index = self.sample_count % len(self.raw)
+                self.times[index] = sample_time
+                self.raw[index] = raw
+                self.sample_count = self.sample_count + 1
+
+                if self.zero_remaining > 0:
+                    self.zero_total = self.zero_total + raw
+                    self.zero_remaining = self.zero_remaining - 1
+
+                    if self.zero_remaining == 0:
+                        self.offset = self.zero_total / self.zero_samples
+                        logger.info(f"Scale zeroed, offset {self.offset:.0f}")
+
+    # Latest n samples (all buffered samples if n is None), oldest first, as arrays of times and raw readings.
+    def latest_samples(self, n=None):
+        with self.lock:
+            available = min(self.sample_count, len(self.raw))
+            n = available if n is None else min(n, available)
+            indexes = numpy.arange(self.sample_count - n, self.sample_count) % len(self.raw)
+
+            return self.times[indexes], self.raw[indexes]
+
+    # Samples read since the total sample count was count, oldest first, as arrays of times and raw readings along
+    # with the new total count. If more than the buffer's worth have been read, just the buffered ones.
+    def samples_since(self, count):
+        with self.lock:
+            sample_count = self.sample_count
+
+        times, raw = self.latest_samples(sample_count - count)
+
+        return times, raw, sample_count
+
+    # Samples per second over the buffered samples, 0 until there are enough to tell.
+    @property
+    def sample_rate(self):
+        times, raw = self.latest_samples()
+
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    # Move the zero by a number of grams, e.g. to follow drift.
+    def adjust_zero(self, grams):
+        with self.lock:
+            self.offset = self.offset + grams * self.ref_unit
+
+    # Weight in grams of a raw reading.
+    def grams(self, raw):
+        return scale_calibration.raw_to_grams(raw, self.ref_unit, self.offset, self.linearity)
+
+
+# The weight on the scale, as used by the GUI. Reads come from the acquisition thread's buffer, so don't block. New
+# samples are run through the filter chain set up in piscale.ini each time the weight is updated, then checked to see
+# if the weight has settled.
+class Weight:
+    def __init__(self):
+        self.weight = None
+
+        config = configparser.ConfigParser()
+        config.read('piscale.ini')
+
+        # Calibration from piscale.ini. The offset is only used until the scale is zeroed.
+        self.ref_unit, offset, linearity = scale_calibration.load_calibration(config, ref_unit, initial_offset)
+
+        self.filter_chain = weight_filters.filter_chain_from_config(config['scale_filter'], abs(self.ref_unit))
+        self.samples_read = 0
+        self.filtered_raw = None
+
+        self.max_std_g = config['scale_stability'].getfloat('max_std_g', 1.0)
+        self.stability = weight_filters.StabilityDetector(config['scale_stability'].getint('window', 10),
+                                                          self.max_std_g)
+
+        # Follows the drift of the zero while the scale is empty, if turned on.
+        self.zero_tracker = None
+
+        if config['zero_tracking'].getboolean('enabled', True):
+            self.zero_tracker = weight_filters.ZeroTracker(config['zero_tracking'].getfloat('band_g', 2.0),
+                                                           config['zero_tracking'].getfloat('hold_s', 5.0),
+                                                           config['zero_tracking'].getfloat('max_step_g', 0.2),
+                                                           config['zero_tracking'].getfloat('max_total_g', 20.0))
+
+        # Connect to the scale and start reading it, zeroing it out from the first samples.
+        self.backend = scale_backends.create_backend(config['scale'], data_pin, clock_pin, self.ref_unit, offset)
+
+        # Raw samples can be recorded for tuning the filters offline.
+        recorder = None
+
+        if config['scale'].getboolean('record', False):
+            recorder = sample_recorder.SampleRecorder(config['scale'].get('record_dir', 'recordings'),
+                                                      max_bytes=config['scale'].getint('record_max_kb', 10240) * 1024)
+            atexit.register(recorder.close)
+
+        self.acquisition = WeightAcquisition(self.backend, self.ref_unit, offset, linearity, recorder=recorder)
+        self.acquisition.daemon = True
+        self.acquisition.start()
+        self.acquisition.zero()
+
+    # Zero out the scale - from the samples already read if the weight is steady, otherwise over the next few samples.
+    # Either way it doesn't wait, taring() is True until it is done.
+    def zero(self):
+        self.acquisition.zero(max_spread=self.max_std_g * abs(self.ref_unit))
+        self.stability.reset()
+
+        if self.zero_tracker is not None:
+            self.zero_tracker.reset()
+
+    # Update the weight from the latest samples - do this regular.
+    def update_weight(self):
+        times, raw, self.samples_read = self.acquisition.samples_since(self.samples_read)
+
+        if len(raw) > 0:
+            filtered = self.filter_chain.process(raw)
+            self.filtered_raw = filtered[-1]
+
+            if not self.acquisition.zeroing():
+                weights = self.acquisition.grams(filtered)
+                self.stability.process(weights)
+
+                if self.zero_tracker is not None:
+                    adjustment = self.zero_tracker.process(times, weights)
+
+                    if adjustment != 0:
+                        self.acquisition.adjust_zero(adjustment)
+
+        # Reads 0 while zeroing, as that is what the scale is being set to, or if there are no samples yet.
+        if self.filtered_raw is None or self.acquisition.zeroing():
+            self.weight = 0.0
+        else:
+            self.weight = self.deadband(round(float(self.acquisition.grams(self.filtered_raw)), 2))
+
+    def get_weight(self):
+        return self.weight
+
+    # True while the scale is being zeroed.
+    def taring(self):
+        return self.acquisition.zeroing()
+
+    # Listener is called with ('settled', weight) or ('unsettled', weight) as the weight settles and changes. Called
+    # from update_weight, so on the GUI thread.
+    def add_listener(self, listener):
+        self.stability.add_listener(lambda event, weight: listener(event, self.deadband(round(weight, 2))))
+
+    # Not settled while the filters are holding back samples that could be a new weight, e.g. food just put on.
+    def is_settled(self):
+        return self.stability.is_settled() and not self.filter_chain.holding()
+
+    # The weight the scale last settled at, or None if it isn't settled.
+    @property
+    def settled_weight(self):
+        if not self.is_settled():
+            return None
+
+        return self.deadband(round(self.stability.settled_weight, 2))
+
+    # Ignore any negative weight greater than 2g - avoids flicker of -ve sign.
+    @staticmethod
+    def deadband(weight):
+        return 0 if 2 > weight > -2 else weight
+
+    # Samples per second being read from the scale.
+    @property
+    def sample_rate(self):
+        return self.acquisition.sample_rate
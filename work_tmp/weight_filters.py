@@ -0,0 +1,320 @@
+import statistics
+
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+import logging
+
+logger = logging.getLogger('scaleLogger')
+
+
+# Filters for the raw load cell samples. Each takes a batch of raw readings as a numpy array and returns a filtered
+# reading for every sample in the batch, carrying what it needs over to the next batch. Thresholds and noise levels
+# are given in grams and converted to raw counts with counts_per_gram.
+
+# Median of each window samples long run of samples, i.e. of the window ending at each sample from the window'th on.
+# Sorting such short rows is much quicker than numpy.median.
+def sliding_median(samples, window):
+    ordered = numpy.sort(sliding_window_view(samples, window), axis=1)
+    middle = window // 2
+
+    if window % 2:
+        return ordered[:, middle]
+
+    return (ordered[:, middle - 1] + ordered[:, middle]) / 2
+
+
+# Median of the last window samples - gets rid of the odd spike without smearing steps.
+class MedianFilter:
+    def __init__(self, window=5):
+        self.window = window
+        self.history = numpy.zeros(0)
+
+    def process(self, batch):
+        samples = numpy.concatenate((self.history, batch))
+        full_window = len(self.history) == self.window - 1
+        self.history = samples[-(self.window - 1):] if self.window > 1 else numpy.zeros(0)
+
+        if full_window:
+            return sliding_median(samples, self.window)
+
+        # Until there is a full window, the first samples are the median of what there is so far. nanmedian is slow,
+        # so is only used until then.
+        padded = numpy.concatenate((numpy.full(self.window - 1, numpy.nan), samples))
+        medians = numpy.nanmedian(sliding_window_view(padded, self.window), axis=1)
+
+        return medians[-len(batch):]
+
+    def reset(self):
+        self.history = numpy.zeros(0)
+
+
+# Exponential smoothing, alpha of 1 is no smoothing.
+class ExponentialFilter:
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.value = None
+
+    def process(self, batch):
+        filtered = numpy.empty(len(batch))
+
+        for i, sample in enumerate(batch):
+            self.value = sample if self.value is None else self.value + self.alpha * (sample - self.value)
+            filtered[i] = self.value
+
+        return filtered
+
+    def reset(self):
+        self.value = None
+
+
+# One dimensional Kalman filter for a weight that is steady apart from the odd change. Settles faster than
+# exponential smoothing for the same noise as it weights new samples by how uncertain the estimate is.
+class KalmanFilter:
+    def __init__(self, process_noise, measurement_noise):
+        self.process_variance = process_noise ** 2
+        self.measurement_variance = measurement_noise ** 2
+        self.value = None
+        self.variance = None
+
+    def process(self, batch):
+        filtered = numpy.empty(len(batch))
+
+        for i, sample in enumerate(batch):
+            if self.value is None:
+                self.value = sample
+                self.variance = self.measurement_variance
+            else:
+                self.variance = self.variance + self.process_variance
+                gain = self.variance / (self.variance + self.measurement_variance)
+                self.value = self.value + gain * (sample - self.value)
+                self.variance = (1 - gain) * self.variance
+
+            filtered[i] = self.value
+
+        return filtered
+
+    def reset(self):
+        self.value = None
+        self.variance = None
+
+
+# Replaces samples that are further than threshold from the median of the recent accepted samples with the last
+# accepted sample. A real change of weight looks like an outlier at first, so once max_rejects samples in a row have
+# been rejected the new level is accepted.
+#
+# Usually nothing in a batch is an outlier, which is checked for the whole batch at once against the medians of a
+# sliding window over the accepted samples and the batch. Only batches with an outlier go through sample by sample.
+class OutlierFilter:
+    def __init__(self, threshold, window=5, max_rejects=3):
+        self.threshold = threshold
+        self.window = window
+        self.max_rejects = max_rejects
+        self.accepted = []
+        self.rejects = 0
+
+    def process(self, batch):
+        if len(self.accepted) == self.window:
+            samples = numpy.concatenate((self.accepted, batch))
+            medians = sliding_median(samples[:-1], self.window)
+
+            if numpy.all(numpy.abs(batch - medians) <= self.threshold):
+                self.rejects = 0
+                self.accepted = samples[-self.window:].tolist()
+                return numpy.array(batch, dtype=float)
+
+        filtered = numpy.empty(len(batch))
+
+        for i, sample in enumerate(batch):
+            if self.accepted and abs(sample - statistics.median(self.accepted)) > self.threshold:
+                self.rejects = self.rejects + 1
+
+                if self.rejects <= self.max_rejects:
+                    filtered[i] = self.accepted[-1]
+                    continue
+
+                logger.debug(f"Accepting new level {sample:.0f} after {self.rejects - 1} rejected samples")
+                self.accepted = []
+
+            self.rejects = 0
+            self.accepted = self.accepted[-(self.window - 1):] + [sample] if self.window > 1 else [sample]
+            filtered[i] = sample
+
+        return filtered
+
+    # True while samples are being rejected - they may turn out to be a new level.
+    def holding(self):
+        return self.rejects > 0
+
+    def reset(self):
+        self.accepted = []
+        self.rejects = 0
+
+
+# Applies filters one after the other.
+class FilterChain:
+    def __init__(self, filters):
+        self.filters = filters
+
+    def process(self, batch):
+        batch = numpy.asarray(batch, dtype=float)
+
+        for sample_filter in self.filters:
+            batch = sample_filter.process(batch)
+
+        return batch
+
+    # True if any of the filters is holding back samples that may be a real change.
+    def holding(self):
+        return any(sample_filter.holding() for sample_filter in self.filters if hasattr(sample_filter, 'holding'))
+
+    def reset(self):
+        for sample_filter in self.filters:
+            sample_filter.reset()
+
+
+# Decides whether the weight has settled from the spread of the last window samples (in grams). Settled once the
+# standard deviation is within max_std, unsettled again when it goes over twice that. Listeners are called with
+# ('settled', weight) and ('unsettled', weight) as that changes, and with 'settled' again if the weight settles at a
+# new value before the change was seen.
+class StabilityDetector:
+    def __init__(self, window=10, max_std=1.0):
+        self.window = window
+        self.max_std = max_std
+        self.samples = numpy.zeros(0)
+        self.settled_weight = None
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def is_settled(self):
+        return self.settled_weight is not None
+
+    def process(self, batch):
+        self.samples = numpy.concatenate((self.samples, batch))[-self.window:]
+
+        if len(self.samples) < self.window:
+            return
+
+        std = self.samples.std()
+        weight = float(self.samples.mean())
+
+        if self.settled_weight is None:
+            if std <= self.max_std:
+                self.settle(weight)
+        elif std > 2 * self.max_std:
+            self.settled_weight = None
+            self.notify('unsettled', weight)
+        elif abs(weight - self.settled_weight) > 2 * self.max_std:
+            self.settle(weight)
+
+    def settle(self, weight):
+        self.settled_weight = weight
+        self.notify('settled', weight)
+
+    def notify(self, event, weight):
+        logger.debug(f"Weight {event} at {weight:.1f}g")
+
+        for listener in self.listeners:
+            listener(event, weight)
+
+    # Start again, e.g. when the scale is zeroed and the weights jump.
+    def reset(self):
+        self.samples = numpy.zeros(0)
+
+        if self.settled_weight is not None:
+            self.settled_weight = None
+            self.notify('unsettled', 0.0)
+
+
+# Tracks the drift of the zero. When the weight (in grams) has stayed within band of zero for hold_time seconds, the
+# zero is nudged towards the average of those samples - by no more than max_step at a time, and no more than max_total
+# in all until the scale is zeroed again. Too small to affect a real weight, which is well outside the band.
+class ZeroTracker:
+    def __init__(self, band=2.0, hold_time=5.0, max_step=0.2, max_total=20.0):
+        self.band = band
+        self.hold_time = hold_time
+        self.max_step = max_step
+        self.max_total = max_total
+
+        self.total = 0.0
+        self.cap_logged = False
+        self.reset_hold()
+
+    # Start timing a new period near zero.
+    def reset_hold(self):
+        self.near_zero_since = None
+        self.near_zero_sum = 0.0
+        self.near_zero_count = 0
+
+    # Takes a batch of sample times and weights and returns the adjustment to make to the zero in grams, 0 for none.
+    def process(self, times, weights):
+        outside = numpy.flatnonzero(numpy.abs(weights) > self.band)
+
+        # Only the samples since the weight last left the band count.
+        if len(outside) > 0:
+            self.reset_hold()
+            times = times[outside[-1] + 1:]
+            weights = weights[outside[-1] + 1:]
+
+        if len(weights) == 0:
+            return 0.0
+
+        if self.near_zero_since is None:
+            self.near_zero_since = times[0]
+
+        self.near_zero_sum = self.near_zero_sum + weights.sum()
+        self.near_zero_count = self.near_zero_count + len(weights)
+
+        if times[-1] - self.near_zero_since < self.hold_time:
+            return 0.0
+
+        drift = self.near_zero_sum / self.near_zero_count
+        adjustment = max(-self.max_step, min(self.max_step, drift))
+        adjustment = max(-self.max_total - self.total, min(self.max_total - self.total, adjustment))
+
+        self.reset_hold()
+
+        if adjustment == 0:
+            if drift != 0 and not self.cap_logged:
+                logger.warning(f"Zero has drifted {self.total:.2f}g, more than tracking will correct - needs zeroing")
+                self.cap_logged = True
+
+            return 0.0
+
+        self.total = self.total + adjustment
+        logger.info(f"Zero tracking drift {drift:.2f}g, adjusted by {adjustment:.2f}g, {self.total:.2f}g in all")
+
+        return adjustment
+
+    # The scale has been zeroed, so start again.
+    def reset(self):
+        self.total = 0.0
+        self.cap_logged = False
+        self.reset_hold()
+
+
+# Builds the filter chain from the scale_filter section of piscale.ini, which lists the filters in the order they are
+# applied.
+def filter_chain_from_config(filter_config, counts_per_gram):
+    filters = []
+
+    for name in [name.strip() for name in filter_config.get('chain', '').split(',') if name.strip()]:
+        if name == 'median':
+            filters.append(MedianFilter(filter_config.getint('median_window', 5)))
+        elif name == 'exponential':
+            filters.append(ExponentialFilter(filter_config.getfloat('exponential_alpha', 0.3)))
+        elif name == 'kalman':
+            filters.append(KalmanFilter(filter_config.getfloat('kalman_process_noise_g', 1.0) * counts_per_gram,
+                                        filter_config.getfloat('kalman_measurement_noise_g', 2.0) * counts_per_gram))
+        elif name == 'outlier':
+            filters.append(OutlierFilter(filter_config.getfloat('outlier_threshold_g', 50.0) * counts_per_gram,
+                                         filter_config.getint('outlier_window', 5),
+                                         filter_config.getint('outlier_max_rejects', 3)))
+        else:
+            raise ValueError(f"Unknown scale filter {name}")
+
+    logger.info(f"Scale filter chain {[type(sample_filter).__name__ for sample_filter in filters]}")
+
+    return FilterChain(filters)